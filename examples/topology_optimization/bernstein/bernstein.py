@@ -185,7 +185,7 @@ def create_forest(comm, depth, htarget):
 
 
 def create_problem(
-    forest, bcs, props, nlevels, iter_offset=0, m_fixed=0.0, use_compliance=False
+    forest, obj, nlevels, trac, r0, iter_offset=0, m_fixed=0.0, use_compliance=False
 ):
     """
     Create the TMRTopoProblem object and set up the topology optimization problem.
@@ -198,25 +198,18 @@ def create_problem(
 
     Args:
         forest (OctForest): Forest object
-        bcs (BoundaryConditions): Boundary condition object
-        props (StiffnessProperties): Material properties object
+        obj (CreatorCallback): Creator callback shared across refinement steps
         nlevels (int): number of multigrid levels
+        trac (list): Components of the traction applied on the traction edge
+        r0 (float): Filter radius
 
     Returns:
         TopoProblem: Topology optimization problem instance
+        Assembler: The finest-level TACS.Assembler object of the problem
     """
-    # Allocate the creator callback function
-    obj = CreatorCallback(bcs, props)
-
     # Create a conforming filter
     filter_type = "lagrange"
 
-    # Characteristic length of the domain
-    r = 0.06
-    a = 0.04
-    area = r * a
-    r0 = 0.025 * np.sqrt(area)
-
     # Create the problem and filter object
     problem = TopOptUtils.createTopoProblem(
         forest,
@@ -238,14 +231,10 @@ def create_problem(
     basis = elems[0].getElementBasis()
 
     # Create the traction objects that will be used later..
-    # Fn = 1000e3 # Normal heat flux
-    Fn = 0.0
-    Ty = -2.5e6  # Traction force component in the y-direction
     vpn = elems[0].getVarsPerNode()
-    trac = [0.0, Ty, Fn]
-    tractions = []
-    for findex in range(4):
-        tractions.append(elements.Traction2D(vpn, findex, basis, trac))
+    tractions = tuple(
+        elements.Traction2D(vpn, findex, basis, trac) for findex in range(4)
+    )
 
     # Allocate a thermal traction boundary condition
     force1 = TopOptUtils.computeTractionLoad("traction", forest, assembler, tractions)
@@ -279,7 +268,7 @@ def create_problem(
     cb = OutputCallback(assembler, iter_offset=iter_offset)
     problem.setOutputCallback(cb.write_output)
 
-    return problem
+    return problem, assembler
 
 
 class OutputCallback:
@@ -362,6 +351,15 @@ a = 0.04
 vol = r * a * t
 vol_frac = args.vol_frac
 
+# Characteristic length of the domain used for the filter radius
+r0 = 0.025 * np.sqrt(r * a)
+
+# Set the traction components applied on the traction edge
+# Fn = 1000e3 # Normal heat flux
+Fn = 0.0
+Ty = -2.5e6  # Traction force component in the y-direction
+trac = [0.0, Ty, Fn]
+
 # Create the first material properties object
 rho = 2600.0 * t
 E = 70e9 * t
@@ -405,6 +403,9 @@ props = TMR.StiffnessProperties(
 bcs = TMR.BoundaryConditions()
 bcs.addBoundaryCondition("fixed", [0, 1, 2], [0.0, 0.0, 50.0])
 
+# Allocate the creator callback function once for all refinement steps
+obj = CreatorCallback(bcs, props)
+
 # Create the initial forest
 forest = create_forest(comm, args.init_depth, args.htarget)
 forest.setMeshOrder(args.order, TMR.GAUSS_LOBATTO_POINTS)
@@ -417,11 +418,12 @@ iter_offset = 0
 for step in range(max_iterations):
     # Create the TMRTopoProblem instance
     nlevels = mg_levels[step]
-    problem = create_problem(
+    problem, assembler = create_problem(
         forest,
-        bcs,
-        props,
+        obj,
         nlevels,
+        trac,
+        r0,
         iter_offset=iter_offset,
         m_fixed=m_fixed,
         use_compliance=True,
@@ -461,7 +463,6 @@ for step in range(max_iterations):
     xopt, z, zw, zl, zu = opt.getOptimizedPoint()
 
     # Refine based solely on the value of the density variable
-    assembler = problem.getAssembler()
     forest = forest.duplicate()
 
     # Perform refinement based on distance
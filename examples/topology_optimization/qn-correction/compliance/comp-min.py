@@ -25,11 +25,99 @@ from utils_comp import create_problem
 
 sys.path.append("../eigenvalue")
 from utils import create_forest, OmAnalysis, getNSkipUpdate
+from utils import compute_discreteness, allgather_1d
 
 sys.path.append("../refactor_frequency")
 from refactor_utils_freq import GeneralEigSolver
 
 
+def compute_optimum_discreteness(comm, problem, x):
+    """
+    Compute the discreteness of the optimal design variables and of the
+    corresponding filtered densities
+
+    Args:
+        comm (MPI communicator)
+        problem (TMR.TopoProblem): the topology optimization problem
+        x (TACS.Vec): the optimal (unfiltered) design variables
+
+    Returns:
+        discreteness, discreteness_rho
+    """
+    rhoopt = problem.getAssembler().createDesignVec()
+    problem.getTopoFilter().applyFilter(x, rhoopt)
+
+    discreteness = compute_discreteness(comm, x.getArray())
+    discreteness_rho = compute_discreteness(comm, rhoopt.getArray())
+    return discreteness, discreteness_rho
+
+
+def create_optimization_options(args, output_files, max_iter):
+    """
+    Create a fresh ParOpt options dict for one mesh refinement step
+
+    Args:
+        args (argparse.Namespace): parsed command line arguments
+        output_files (dict): output file names for this refinement step
+        max_iter (int): maximum number of optimization iterations for this step
+
+    Returns:
+        options for the MMA optimizer if args.optimizer == "mma", otherwise
+        options for the trust region optimizer
+    """
+    if args.optimizer == "mma":
+        return {
+            "algorithm": "mma",
+            "mma_asymptote_contract": 0.7,
+            "mma_asymptote_relax": 1.2,
+            "mma_bound_relax": 0,
+            "mma_delta_regularization": 1e-05,
+            "mma_eps_regularization": 0.001,
+            "mma_infeas_tol": 1e-05,
+            "mma_init_asymptote_offset": 0.25,
+            "mma_l1_tol": 1e-06,
+            "mma_linfty_tol": 1e-06,
+            "mma_max_asymptote_offset": 10,
+            "mma_max_iterations": max_iter,
+            "mma_min_asymptote_offset": 0.01,
+            "mma_use_constraint_linearization": True,
+            "mma_move_limit": 0.3,
+            "mma_output_file": output_files["mma_output_file"],
+        }
+
+    return {
+        "algorithm": "tr",
+        "output_level": args.output_level,
+        "norm_type": "l1",
+        "tr_init_size": 0.05,
+        "tr_min_size": args.tr_min,
+        "tr_max_size": 1.0,
+        "tr_eta": args.tr_eta,
+        "tr_infeas_tol": 1e-6,
+        "tr_l1_tol": 0.0,
+        "tr_linfty_tol": 0.0,
+        "tr_adaptive_gamma_update": args.paropt_type == "penalty_method",
+        "tr_accept_step_strategy": args.paropt_type,
+        "filter_sufficient_reduction": args.simple_filter,
+        "filter_has_feas_restore_phase": True,
+        "tr_use_soc": False,
+        "tr_max_iterations": max_iter,
+        "penalty_gamma": 50.0,
+        "qn_subspace_size": args.qn_subspace,  # try 5 or 10
+        "qn_type": args.hessian,
+        "qn_diag_type": "yty_over_yts",
+        "abs_res_tol": 1e-8,
+        "starting_point_strategy": "affine_step",
+        "barrier_strategy": "mehrotra_predictor_corrector",
+        "tr_steering_barrier_strategy": "mehrotra_predictor_corrector",
+        "tr_steering_starting_point_strategy": "affine_step",
+        "use_line_search": False,  # subproblem
+        "max_major_iters": 200,
+        "output_file": output_files["output_file"],
+        "tr_output_file": output_files["tr_output_file"],
+    }
+
+
 if __name__ == "__main__":
     # Create the argument parser
     p = argparse.ArgumentParser()
@@ -72,6 +160,11 @@ if __name__ == "__main__":
     p.add_argument("--tr-min", type=float, default=1e-3)
     p.add_argument("--eq-constr", action="store_true")
     p.add_argument("--qn-subspace", type=int, default=2)
+    p.add_argument(
+        "--gep",
+        action="store_true",
+        help="run a generalized eigenvalue analysis at the optimum of each step",
+    )
     p.add_argument(
         "--paropt-type",
         type=str,
@@ -102,9 +195,6 @@ if __name__ == "__main__":
         with open(os.path.join(prefix, "exe.sh"), "w") as f:
             f.write(cmd + "\n")
 
-    # Barrier here
-    comm.Barrier()
-
     # Geometry parameters
     lx = args.len0 * args.AR
     ly = args.len0
@@ -135,59 +225,6 @@ if __name__ == "__main__":
     else:
         bcs.addBoundaryCondition("fixed", [0, 1, 2], [0.0, 0.0, 0.0])
 
-    # Set up ParOpt parameters
-    if args.paropt_type == "penalty_method":
-        adaptive_gamma_update = True
-    else:
-        adaptive_gamma_update = False
-    optimization_options = {
-        "algorithm": "tr",
-        "output_level": args.output_level,
-        "norm_type": "l1",
-        "tr_init_size": 0.05,
-        "tr_min_size": args.tr_min,
-        "tr_max_size": 1.0,
-        "tr_eta": args.tr_eta,
-        "tr_infeas_tol": 1e-6,
-        "tr_l1_tol": 0.0,
-        "tr_linfty_tol": 0.0,
-        "tr_adaptive_gamma_update": adaptive_gamma_update,
-        "tr_accept_step_strategy": args.paropt_type,
-        "filter_sufficient_reduction": args.simple_filter,
-        "filter_has_feas_restore_phase": True,
-        "tr_use_soc": False,
-        "tr_max_iterations": args.max_iter,
-        "penalty_gamma": 50.0,
-        "qn_subspace_size": args.qn_subspace,  # try 5 or 10
-        "qn_type": args.hessian,
-        "qn_diag_type": "yty_over_yts",
-        "abs_res_tol": 1e-8,
-        "starting_point_strategy": "affine_step",
-        "barrier_strategy": "mehrotra_predictor_corrector",
-        "tr_steering_barrier_strategy": "mehrotra_predictor_corrector",
-        "tr_steering_starting_point_strategy": "affine_step",
-        "use_line_search": False,  # subproblem
-        "max_major_iters": 200,
-    }
-
-    mma_options = {
-        "algorithm": "mma",
-        "mma_asymptote_contract": 0.7,
-        "mma_asymptote_relax": 1.2,
-        "mma_bound_relax": 0,
-        "mma_delta_regularization": 1e-05,
-        "mma_eps_regularization": 0.001,
-        "mma_infeas_tol": 1e-05,
-        "mma_init_asymptote_offset": 0.25,
-        "mma_l1_tol": 1e-06,
-        "mma_linfty_tol": 1e-06,
-        "mma_max_asymptote_offset": 10,
-        "mma_max_iterations": args.max_iter,
-        "mma_min_asymptote_offset": 0.01,
-        "mma_use_constraint_linearization": True,
-        "mma_move_limit": 0.3,
-    }
-
     # Set the original filter to NULL
     orig_filter = None
     xopt = None
@@ -195,8 +232,24 @@ if __name__ == "__main__":
     # Do not use density-based refinement. Use an approximate distance based refinement.
     density_based_refine = False
 
+    # Compute the characteristic domain length for the distance based refinement
+    vol = lx * ly * lz
+    domain_length = vol ** (1.0 / 3.0)
+    refine_distance = 0.025 * domain_length
+
     count = 0
     max_iterations = args.n_mesh_refine
+
+    # Set the output files for each refinement step
+    step_files = [
+        {
+            "output_file": os.path.join(prefix, "output_file%d.dat" % (step)),
+            "tr_output_file": os.path.join(prefix, "tr_output_file%d.dat" % (step)),
+            "mma_output_file": os.path.join(prefix, "mma_output_file%d.dat" % (step)),
+        }
+        for step in range(max_iterations)
+    ]
+
     for step in range(max_iterations):
         # Create the problem
         iter_offset = step * args.max_iter
@@ -241,33 +294,24 @@ if __name__ == "__main__":
                 TopOptUtils.interpolateDesignVec(orig_filter, xopt, filtr, x)
                 problem.setInitDesignVars(x)
         else:
+            # Create the design vector for this step, it is reused to store
+            # the optimum since these optimizers do not return a ParOpt vector
+            x = problem.createDesignVec()
+            x_init = TMR.convertPVecToVec(x).getArray()
             if orig_filter is not None:
-                x = problem.createDesignVec()
                 TopOptUtils.interpolateDesignVec(orig_filter, xopt, filtr, x)
-                x_init = TMR.convertPVecToVec(x).getArray()
             else:
-                x = problem.createDesignVec()
-                x_init = TMR.convertPVecToVec(x).getArray()
                 x_init[:] = 0.95
 
         orig_filter = filtr
 
-        if max_iterations > 1:
-            if step == max_iterations - 1:
-                optimization_options["tr_max_iterations"] = args.niter_finest
-                mma_options["mma_max_iterations"] = args.niter_finest
+        # Use fewer optimization iterations on the finest mesh
+        if max_iterations > 1 and step == max_iterations - 1:
+            max_iter = args.niter_finest
+        else:
+            max_iter = args.max_iter
         count += args.max_iter
 
-        optimization_options["output_file"] = os.path.join(
-            prefix, "output_file%d.dat" % (step)
-        )
-        optimization_options["tr_output_file"] = os.path.join(
-            prefix, "tr_output_file%d.dat" % (step)
-        )
-        mma_options["mma_output_file"] = os.path.join(
-            prefix, "mma_output_file%d.dat" % (step)
-        )
-
         # Optimize using mma4py
         if args.optimizer == "mma4py":
             from mma4py import Problem as MMAProblemBase
@@ -295,21 +339,21 @@ if __name__ == "__main__":
                     return
 
                 def evalObjCon(self, x, cons) -> float:
-                    self.xvals[:] = x[:]
+                    np.copyto(self.xvals, x)
                     fail, obj, _cons = self.prob.evalObjCon(self.ncon, self.xvec)
-                    cons[:] = -_cons[:]
+                    np.negative(_cons, out=cons)
                     return obj
 
                 def evalObjConGrad(self, x, g, gcon):
-                    self.xvals[:] = x[:]
+                    np.copyto(self.xvals, x)
                     self.prob.evalObjConGradient(self.xvec, self.gvec, [self.gcvec])
-                    g[:] = self.gvals[:]
-                    gcon[0, :] = -self.gcvals[:]
+                    np.copyto(g, self.gvals)
+                    np.negative(self.gcvals, out=gcon[0])
                     return
 
             nvars_l = len(x_init)
-            nvars = np.zeros(1, dtype=type(nvars_l))
-            comm.Allreduce(np.array([nvars_l]), nvars)
+            nvars = np.zeros(1, dtype=np.int64)
+            comm.Allreduce(np.array([nvars_l], dtype=np.int64), nvars, op=MPI.SUM)
             mmaprob = MMAProblem(comm, nvars[0], nvars_l, problem)
             out_file = os.path.join(prefix, "mma4py_output_file%d.dat" % (step))
             mmaopt = MMAOptimizer(mmaprob, out_file)
@@ -328,26 +372,12 @@ if __name__ == "__main__":
             )
 
             # Get optimal objective and constraint
-            xopt_vals = mmaopt.getOptimizedDesign()
-            xopt = problem.createDesignVec()
-            TMR.convertPVecToVec(xopt).getArray()[:] = xopt_vals[:]
+            xopt = x
+            xopt_vec = TMR.convertPVecToVec(xopt)
+            xopt_vec.getArray()[:] = mmaopt.getOptimizedDesign()
             fail, obj, cons = problem.evalObjCon(1, xopt)
             con = cons[0]
 
-            # Compute discreteness
-            xopt_global = comm.allgather(xopt_vals)
-            xopt_global = np.concatenate(xopt_global)
-            discreteness = np.dot(xopt_global, 1.0 - xopt_global) / len(xopt_global)
-
-            # Compute discreteness for rho
-            rhoopt = problem.getAssembler().createDesignVec()
-            problem.getTopoFilter().applyFilter(TMR.convertPVecToVec(xopt), rhoopt)
-            rhoopt_global = comm.allgather(rhoopt.getArray())
-            rhoopt_global = np.concatenate(rhoopt_global)
-            discreteness_rho = np.dot(rhoopt_global, 1.0 - rhoopt_global) / len(
-                rhoopt_global
-            )
-
         # Optimize with openmdao/pyoptsparse wrapper if specified
         elif args.optimizer == "snopt" or args.optimizer == "ipopt":
             # Broadcast local size to all processor
@@ -367,9 +397,9 @@ if __name__ == "__main__":
             analysis = OmAnalysis(comm, problem, obj_callback, sizes, offsets)
             indeps = prob.model.add_subsystem("indeps", om.IndepVarComp())
 
-            # Create global design vector
-            x_init_global = comm.allgather(x_init)
-            x_init_global = np.concatenate(x_init_global)
+            # Every processor registers the same global starting point with
+            # the independent variable, gathered with a single Allgatherv
+            x_init_global = allgather_1d(comm, x_init, sizes, offsets)
             indeps.add_output("x", x_init_global)
             prob.model.add_subsystem("topo", analysis)
             prob.model.connect("indeps.x", "topo.x")
@@ -396,12 +426,7 @@ if __name__ == "__main__":
                 prob.driver.opt_settings["Major print level"] = 1
                 prob.driver.opt_settings["Minor print level"] = 0
 
-                if max_iterations > 1 and step == max_iterations - 1:
-                    prob.driver.opt_settings["Major iterations limit"] = (
-                        args.niter_finest
-                    )
-                else:
-                    prob.driver.opt_settings["Major iterations limit"] = args.max_iter
+                prob.driver.opt_settings["Major iterations limit"] = max_iter
 
             elif args.optimizer == "ipopt":
                 prob.driver = om.pyOptSparseDriver()
@@ -415,54 +440,39 @@ if __name__ == "__main__":
                     prefix, "ipopt_output_file%d.dat" % (step)
                 )
 
-                if max_iterations > 1 and step == max_iterations - 1:
-                    prob.driver.opt_settings["max_iter"] = args.niter_finest
-                else:
-                    prob.driver.opt_settings["max_iter"] = args.max_iter
+                prob.driver.opt_settings["max_iter"] = max_iter
 
             # Optimize
             prob.setup()
             prob.run_model()
             prob.run_driver()
 
-            # Get optimal result from root processor and broadcast
+            # Scatter the optimal result from root processor into the
+            # distributed design vector to hot-start the optimization on
+            # finer mesh
+            xopt = x
+            xopt_vec = TMR.convertPVecToVec(xopt)
             if comm.rank == 0:
-                xopt_global = prob.get_val("indeps.x")
+                xopt_global = np.asarray(prob.get_val("indeps.x"), dtype=float)
+                sendbuf = [xopt_global, sizes, offsets, MPI.DOUBLE]
             else:
-                xopt_global = None
-            xopt_global = comm.bcast(xopt_global, root=0)
-
-            # Create a distributed vector and store the optimal solution
-            # to hot-start the optimization on finer mesh
-            xopt = problem.createDesignVec()
-            xopt_vals = TMR.convertPVecToVec(xopt).getArray()
-            xopt_vals[:] = xopt_global[start:end]
+                sendbuf = None
+            comm.Scatterv(sendbuf, xopt_vec.getArray(), root=0)
 
             # Write result to f5 file
             analysis.write_output(prefix, step)
 
             # Compute data of interest
-            discreteness = np.dot(xopt_global, 1.0 - xopt_global) / len(xopt_global)
             obj = prob.get_val("topo.obj")[0]
             con = prob.get_val("topo.con")[0]
 
-            # Compute discreteness for rho
-            rhoopt = problem.getAssembler().createDesignVec()
-            problem.getTopoFilter().applyFilter(TMR.convertPVecToVec(xopt), rhoopt)
-            rhoopt_global = comm.allgather(rhoopt.getArray())
-            rhoopt_global = np.concatenate(rhoopt_global)
-            discreteness_rho = np.dot(rhoopt_global, 1.0 - rhoopt_global) / len(
-                rhoopt_global
-            )
-
         # Otherwise, use ParOpt.Optimizer to optimize
         else:
-            if args.optimizer == "mma":
-                opt = ParOpt.Optimizer(problem, mma_options)
-            else:
-                opt = ParOpt.Optimizer(problem, optimization_options)
+            opts = create_optimization_options(args, step_files[step], max_iter)
+            opt = ParOpt.Optimizer(problem, opts)
             opt.optimize()
             xopt, z, zw, zl, zu = opt.getOptimizedPoint()
+            xopt_vec = TMR.convertPVecToVec(xopt)
 
             # If we use MMA, manually create the f5 file
             if args.optimizer == "mma":
@@ -481,28 +491,20 @@ if __name__ == "__main__":
             fail, obj, cons = problem.evalObjCon(1, xopt)
             con = cons[0]
 
-            # Compute discreteness
-            xopt_vals = TMR.convertPVecToVec(xopt).getArray()
-            xopt_global = comm.allgather(xopt_vals)
-            xopt_global = np.concatenate(xopt_global)
-            discreteness = np.dot(xopt_global, 1.0 - xopt_global) / len(xopt_global)
-
-            # Compute discreteness for rho
-            rhoopt = problem.getAssembler().createDesignVec()
-            problem.getTopoFilter().applyFilter(TMR.convertPVecToVec(xopt), rhoopt)
-            rhoopt_global = comm.allgather(rhoopt.getArray())
-            rhoopt_global = np.concatenate(rhoopt_global)
-            discreteness_rho = np.dot(rhoopt_global, 1.0 - rhoopt_global) / len(
-                rhoopt_global
-            )
+        # Compute discreteness for the design variables and rho
+        discreteness, discreteness_rho = compute_optimum_discreteness(
+            comm, problem, xopt_vec
+        )
 
-        # Try to perform a generalized eigenvalue analysis
-        ges = GeneralEigSolver(problem, max_jd_size=200, max_gmres_size=30)
-        try:
-            evals, evecs, res = ges.compute(xopt)
-        except:
-            evals, evecs, res = None, None, None
-        del ges
+        # Try to perform a generalized eigenvalue analysis if requested
+        evals, evecs, res = None, None, None
+        if args.gep:
+            ges = GeneralEigSolver(problem, max_jd_size=200, max_gmres_size=30)
+            try:
+                evals, evecs, res = ges.compute(xopt)
+            except:
+                pass
+            del ges
 
         # Compute infeasibility
         if args.eq_constr:
@@ -546,18 +548,24 @@ if __name__ == "__main__":
             pkl["cmd"] = cmd
             pkl["problem"] = "comp-min"
             pkl["paropt-type"] = args.paropt_type
-            pkl["gep-evals"] = evals
-            pkl["gep-res"] = res
             pkl["qn-time"] = None
             if args.qn_correction:
                 pkl["qn-time"] = obj_callback.getAveragedQnTime()
 
-            # Save snapshot
-            pkl["snapshot"] = obj_callback.get_snapshot()
-            assert len(obj_callback.get_snapshot()["iter"]) == len(
-                constr_callback.get_snapshot()["iter"]
-            )
-            pkl["snapshot"]["infeas"] = constr_callback.get_snapshot()["infeas"]
+            # Array-valued results (the snapshot history and the eigenvalue
+            # analysis) are saved to a separate npz file instead of the
+            # pickle, the keys of the snapshot are prefixed with "snapshot-".
+            # gep-evals and gep-res are only present if --gep is given and
+            # the eigenvalue analysis succeeded
+            snapshot = obj_callback.get_snapshot()
+            constr_snapshot = constr_callback.get_snapshot()
+            assert len(snapshot["iter"]) == len(constr_snapshot["iter"])
+            snapshot["infeas"] = constr_snapshot["infeas"]
+            arrays = {"snapshot-" + key: val for key, val in snapshot.items()}
+            if evals is not None:
+                arrays["gep-evals"] = evals
+                arrays["gep-res"] = res
+            np.savez(os.path.join(prefix, "output_refine%d.npz" % (step)), **arrays)
 
             if args.optimizer == "paropt":
                 (
@@ -565,12 +573,10 @@ if __name__ == "__main__":
                     pkl["neg_curvs"],
                     pkl["pos_curvs"],
                 ) = obj_callback.getFailQnCorr()
-                pkl["n_skipH"] = getNSkipUpdate(
-                    os.path.join(prefix, "tr_output_file%d.dat" % (step))
-                )
+                pkl["n_skipH"] = getNSkipUpdate(step_files[step]["tr_output_file"])
 
             with open(os.path.join(prefix, "output_refine%d.pkl" % (step)), "wb") as f:
-                pickle.dump(pkl, f)
+                pickle.dump(pkl, f, protocol=pickle.HIGHEST_PROTOCOL)
 
         # Output for visualization (Are these two lines needed?)
         assembler = problem.getAssembler()
@@ -584,11 +590,6 @@ if __name__ == "__main__":
             else:
                 # Perform refinement based on distance
                 dist_file = os.path.join(prefix, "distance_solution%d.f5" % (step))
-
-                # Compute the characteristic domain length
-                vol = lx * ly * lz
-                domain_length = vol ** (1.0 / 3.0)
-                refine_distance = 0.025 * domain_length
                 TopOptUtils.approxDistanceRefine(
                     forest,
                     filtr,
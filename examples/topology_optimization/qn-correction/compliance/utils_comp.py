@@ -9,7 +9,7 @@ from mpi4py import MPI
 
 sys.path.append("../eigenvalue")
 from utils import OctCreator, CreatorCallback, MFilterCreator, OutputCallback
-from utils import MassConstr
+from utils import MassConstr, compute_discreteness
 
 # Print colored text in terminal
 try:
@@ -292,20 +292,12 @@ class CompObj:
             fltr.getDesignVars(self.snapshot_x)
             self.assembler.getDesignVars(self.snapshot_rho)
 
-            # Compute discreteness
-            snapshot_x_global = self.comm.allgather(self.snapshot_x.getArray())
-            snapshot_x_global = np.concatenate(snapshot_x_global)
-            discreteness = np.dot(snapshot_x_global, 1.0 - snapshot_x_global) / len(
-                snapshot_x_global
+            # Compute discreteness of x and rho
+            discreteness = compute_discreteness(self.comm, self.snapshot_x.getArray())
+            discreteness_rho = compute_discreteness(
+                self.comm, self.snapshot_rho.getArray()
             )
 
-            # Compute discreteness for rho
-            snapshot_rho_global = self.comm.allgather(self.snapshot_rho.getArray())
-            snapshot_rho_global = np.concatenate(snapshot_rho_global)
-            discreteness_rho = np.dot(
-                snapshot_rho_global, 1.0 - snapshot_rho_global
-            ) / len(snapshot_rho_global)
-
             self.snapshot["discreteness"].append(discreteness)
             self.snapshot["discreteness_rho"].append(discreteness_rho)
 
@@ -364,6 +356,7 @@ class CompObj:
             s (PVec): unfiltered update step
             y (PVec): y = Bs
             z, zw: dummy variable for qn correction for constraints, not used here.
+            zero_idx (int array): indices to-be-zeroed for a reduced problem, or None
         """
         # Timer
         t_start = MPI.Wtime()
@@ -380,7 +373,7 @@ class CompObj:
         self.svec.zeroEntries()
         self.fltr.applyFilter(TMR.convertPVecToVec(s), self.svec)
 
-        if zero_idx:
+        if zero_idx is not None:
             self.svec_vals[zero_idx] = 0.0
 
         self.rho.axpy(h, self.svec)
@@ -415,7 +408,7 @@ class CompObj:
         # Compute dg/h
         self.update.scale(1 / h)
 
-        if zero_idx:
+        if zero_idx is not None:
             self.update_vals[zero_idx] = 0.0
 
         # Compute curvature and check the norm of the update
@@ -444,7 +437,7 @@ class CompObj:
             self.pos_curvs.append(curvature)
             y_wrap = TMR.convertPVecToVec(y)
             self.fltr.applyTranspose(self.update, self.update)
-            if zero_idx:
+            if zero_idx is not None:
                 self.update_vals[zero_idx] = 0.0
             y_wrap.axpy(1.0, self.update)
 
@@ -5,6 +5,7 @@ import numpy as np
 import openmdao.api as om
 import os
 from datetime import datetime
+from mpi4py import MPI
 
 # Print colored text in terminal
 try:
@@ -1258,6 +1259,51 @@ def create_problem(
     return problem, obj_callback
 
 
+def compute_discreteness(comm, vals):
+    """
+    Compute the discreteness sum(x*(1 - x))/n of a distributed vector
+
+    Only the local sums and the local size are reduced across processors,
+    so the full vector is never gathered. The product x*(1 - x) is expanded
+    as sum(x) - x.x to avoid forming the temporary 1 - x.
+
+    Args:
+        comm (MPI communicator)
+        vals (np.ndarray): the locally owned entries of the vector
+    """
+    local = np.array([np.sum(vals), np.dot(vals, vals), len(vals)], dtype=float)
+    total = np.zeros(3)
+    comm.Allreduce(local, total, op=MPI.SUM)
+    return (total[0] - total[1]) / total[2]
+
+
+def allgather_1d(comm, arr, sizes=None, offsets=None):
+    """
+    Gather a distributed 1d array into a global float64 array on every
+    processor using Allgatherv, which avoids pickling the local arrays
+
+    Args:
+        comm (MPI.Comm): communicator
+        arr (np.ndarray): local portion of the array
+        sizes (list): sizes of the local arrays on each processor, queried
+                      from comm if not given
+        offsets (list): global index of the first entry of each local array,
+                        computed from sizes if not given
+
+    Returns:
+        np.ndarray: the global array
+    """
+    local = np.ascontiguousarray(arr, dtype=np.float64)
+    if sizes is None:
+        sizes = comm.allgather(local.size)
+    sizes = np.asarray(sizes, dtype=int)
+    if offsets is None:
+        offsets = np.cumsum(sizes) - sizes
+    buf = np.empty(np.sum(sizes), dtype=np.float64)
+    comm.Allgatherv(local, [buf, sizes, offsets, MPI.DOUBLE])
+    return buf
+
+
 class OmAnalysis(om.ExplicitComponent):
     """
     This class wraps the analyses with openmdao interface such that
@@ -1367,13 +1413,12 @@ class OmAnalysis(om.ExplicitComponent):
         if fail:
             raise RuntimeError("Failed to evaluate objective and constraints!")
         else:
-            global_g = self.comm.allgather(self.g_vals)
-            global_g = np.concatenate(global_g)
-            global_A = self.comm.allgather(self.A_vals)
-            global_A = np.concatenate(global_A)
-
-            partials["obj", "x"] = global_g
-            partials["con", "x"] = global_A
+            partials["obj", "x"] = allgather_1d(
+                self.comm, self.g_vals, self.sizes, self.offsets
+            )
+            partials["con", "x"] = allgather_1d(
+                self.comm, self.A_vals, self.sizes, self.offsets
+            )
 
         return
 
@@ -1392,9 +1437,7 @@ class OmAnalysis(om.ExplicitComponent):
 
         self.obj_callback.qn_correction(x_PVec, z, zw, s_PVec, y_PVec)
 
-        y_vals_global = self.comm.allgather(y_vals)
-        y_vals_global = np.concatenate(y_vals_global)
-        y[:] = y_vals_global[:]
+        y[:] = allgather_1d(self.comm, y_vals, self.sizes, self.offsets)
 
         return
 
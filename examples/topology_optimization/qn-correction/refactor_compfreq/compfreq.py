@@ -625,11 +625,23 @@ if __name__ == "__main__":
             pkl["lambda0"] = args.lambda0
             pkl["problem"] = "frequency"
             pkl["paropt-type"] = args.paropt_type
-            pkl["gep-evals"] = evals
-            pkl["gep-res"] = res
-            pkl["snapshot"] = redu_prob.get_snapshot()
             pkl["qn-time"] = None
 
+            # Array-valued results (the snapshot history and the eigenvalue
+            # analysis) are saved to a separate npz file instead of the
+            # pickle, the keys of the snapshot are prefixed with "snapshot-".
+            # gep-evals and gep-res are only present if the eigenvalue
+            # analysis succeeded
+            arrays = {
+                "snapshot-" + key: val for key, val in redu_prob.get_snapshot().items()
+            }
+            if evals is not None:
+                arrays["gep-evals"] = evals
+                arrays["gep-res"] = res
+            np.savez(
+                os.path.join(args.prefix, "output_refine%d.npz" % (step)), **arrays
+            )
+
             if args.qn_correction:
                 pkl["qn-time"] = freq_constr.getAveragedQnTime()
 
@@ -70,6 +70,9 @@ if __name__ == "__main__":
     p.add_argument("--qn-correction", action="store_true")
     p.add_argument("--mscale", type=float, default=10.0)
     p.add_argument("--kscale", type=float, default=1.0)
+    p.add_argument("--debug", action="store_true")
+    p.add_argument("--eig-rtol-init", type=float, default=None)
+    p.add_argument("--qn-central-diff", action="store_true")
     p.add_argument(
         "--fixed-mass",
         type=float,
@@ -237,6 +240,9 @@ if __name__ == "__main__":
             max_gmres_size=args.max_gmres_size,
             mscale=args.mscale,
             kscale=args.kscale,
+            debug=args.debug,
+            eig_rtol_init=args.eig_rtol_init,
+            qn_central_difference=args.qn_central_diff,
         )
 
         # Function handle for qn correction, if specified
@@ -265,6 +271,7 @@ if __name__ == "__main__":
             fixed_dv_idx,
             fixed_dv_val=args.fixed_mass,
             qn_correction_func=qn_corr_func,
+            snapshot_file=os.path.join(prefix, "snapshot%d.csv" % (step)),
         )
 
         # Check gradient and exit
@@ -285,11 +292,12 @@ if __name__ == "__main__":
             indices = find_indices(
                 forest, args.domain, args.len0, args.AR, args.ratio, xmax=xmax
             )
-            _x[:] = 0.05
-            if indices:
-                _x[indices] = 0.95
+            _x_vals = TMR.convertPVecToVec(_x).getArray()
+            _x_vals[:] = 0.05
+            if indices.size:
+                _x_vals[indices] = 0.95
             if fixed_dv_idx:
-                _x[fixed_dv_idx] = 0.0
+                _x_vals[fixed_dv_idx] = 0.0
 
             # Run
             test_beam_frequency(
@@ -477,11 +485,10 @@ if __name__ == "__main__":
             omprob.run_driver()
 
             # Get optimal result from root processor and broadcast
+            redu_xopt_g = np.empty(analysis.global_size)  # Global vector
             if comm.rank == 0:
-                redu_xopt_g = omprob.get_val("indeps.x")  # Global vector
-            else:
-                redu_xopt_g = None
-            redu_xopt_g = comm.bcast(redu_xopt_g, root=0)
+                np.copyto(redu_xopt_g, omprob.get_val("indeps.x"))
+            comm.Bcast([redu_xopt_g, MPI.DOUBLE], root=0)
 
             # Create a distributed vector and store the optimal solution
             # to hot-start the optimization on finer mesh
@@ -548,6 +555,7 @@ if __name__ == "__main__":
         # Populate _xopt
         _xopt = problem.createDesignVec()
         redu_prob.reduDVtoDV(redu_xopt, _xopt)
+        redu_prob.close()
 
         # Solve the generalized eigenvalue problem once to cross-check the feasibility
         ges = GeneralEigSolver(
@@ -605,10 +613,21 @@ if __name__ == "__main__":
             pkl["lambda0"] = args.lambda0
             pkl["problem"] = "frequency"
             pkl["paropt-type"] = args.paropt_type
-            pkl["gep-evals"] = evals
-            pkl["gep-res"] = res
-            pkl["snapshot"] = redu_prob.get_snapshot()
             pkl["qn-time"] = None
+
+            # Array-valued results (the snapshot history and the eigenvalue
+            # analysis) are saved to a separate npz file instead of the
+            # pickle, the keys of the snapshot are prefixed with "snapshot-".
+            # gep-evals and gep-res are only present if the eigenvalue
+            # analysis succeeded
+            arrays = {
+                "snapshot-" + key: val for key, val in redu_prob.get_snapshot().items()
+            }
+            if evals is not None:
+                arrays["gep-evals"] = evals
+                arrays["gep-res"] = res
+            np.savez(os.path.join(prefix, "output_refine%d.npz" % (step)), **arrays)
+
             if args.qn_correction:
                 pkl["qn-time"] = constr_callback.getAveragedQnTime()
 
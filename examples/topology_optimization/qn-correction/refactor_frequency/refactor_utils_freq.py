@@ -4,12 +4,40 @@ from paropt import ParOpt
 from egads4py import egads
 import numpy as np
 import openmdao.api as om
+import hashlib
 import os
 import sys
 from mpi4py import MPI
 
 sys.path.append("../eigenvalue")
 from utils import OctCreator, CreatorCallback, MFilterCreator, OutputCallback
+from utils import compute_discreteness
+
+
+def domain_dims(domain, len0, AR, ratio):
+    """
+    Compute the dimensions and the volume of the design domain
+
+    Args:
+        domain (str): domain type
+        len0 (float): characteristic length of the domain
+        AR (float): aspect ratio of the domain
+        ratio (float): ratio used by the lbracket domain
+
+    Returns:
+        lx, ly, lz, vol
+    """
+    lx = len0 * AR
+    ly = len0
+    lz = len0
+    if domain == "lbracket":
+        ly = len0 * ratio
+    vol = lx * ly * lz
+    if domain == "lbracket":
+        S1 = lx * lz
+        S2 = lx * lz * (1.0 - ratio) ** 2
+        vol = (S1 - S2) * ly
+    return lx, ly, lz, vol
 
 
 class FrequencyConstr:
@@ -40,6 +68,10 @@ class FrequencyConstr:
         add_non_design_mass=True,
         mscale=10.0,
         kscale=1.0,
+        debug=False,
+        eig_rtol=1e-6,
+        eig_rtol_init=None,
+        qn_central_difference=False,
     ):
         """
         Args:
@@ -47,6 +79,13 @@ class FrequencyConstr:
                        KS approximation with smaller skrho
             num_eigenvalues: number of smallest eigenvalues to compute
             ksrho: KS parameter
+            debug: print out eigenvector residuals and norms for each evaluation
+            eig_rtol: relative tolerance of the Jacobi-Davidson eigensolver
+            eig_rtol_init: if given, the eigensolver starts with this looser
+                           tolerance, which is halved at every evaluation until
+                           it reaches eig_rtol
+            qn_central_difference: use central difference instead of forward
+                                   difference for the qn correction
         """
 
         # Set objects
@@ -58,11 +97,7 @@ class FrequencyConstr:
         self.iter_offset = iter_offset
         self.len0 = len0
         self.AR = AR
-        self.lx = len0 * AR
-        self.ly = len0
-        self.lz = len0
-        if domain == "lbracket":
-            self.ly = len0 * ratio
+        self.lx, self.ly, self.lz, _ = domain_dims(domain, len0, AR, ratio)
         self.ratio = ratio
         self.lambda0 = lambda0
         self.eig_scale = eig_scale
@@ -73,6 +108,11 @@ class FrequencyConstr:
         self.add_non_design_mass = add_non_design_mass
         self.mscale = mscale
         self.kscale = kscale
+        self.debug = debug
+        self.eig_rtol = eig_rtol
+        self.eig_rtol_init = eig_rtol_init
+        self.qn_central_difference = qn_central_difference
+        self.num_evals = 0
 
         self.old_min_eigval = 0.0
 
@@ -92,18 +132,31 @@ class FrequencyConstr:
         self.temp = None
         self.mvec = None
 
+        # g(rho) saved by constraint_gradient for the forward difference in
+        # qn_correction, only valid until the eigenpairs are updated again
+        self.g_rho = None
+        self.g_rho_valid = False
+
+        # Output flag for the f5 files written by this class
+        self.f5_flag = (
+            TACS.OUTPUT_CONNECTIVITY
+            | TACS.OUTPUT_NODES
+            | TACS.OUTPUT_DISPLACEMENTS
+            | TACS.OUTPUT_EXTRAS
+        )
+
         # TACS Matrices
         self.mmat = None
-        self.m0mat = None
-        self.k0mat = None
+        self.a0mat = None
         self.Amat = None
         self.mgmat = None
 
         # We keep track of failed qn correction
         self.curvs = []
 
-        # Time qn step
-        self.qn_time = []
+        # Time qn step, only the total is needed for the average
+        self.qn_time = 0.0
+        self.qn_count = 0
 
         return
 
@@ -133,9 +186,6 @@ class FrequencyConstr:
             self.eigv = []
             for i in range(self.num_eigenvalues):
                 self.eigv.append(self.assembler.createVec())
-            self.deig = []
-            for i in range(self.num_eigenvalues):
-                self.deig.append(self.assembler.createDesignVec())
 
             # Allocate vectors for qn correction
             self.rho = self.assembler.createDesignVec()
@@ -144,6 +194,15 @@ class FrequencyConstr:
             self.update_vals = self.update.getArray()
             self.temp = self.assembler.createDesignVec()
             self.temp_vals = self.temp.getArray()
+            self.g_rho = self.assembler.createDesignVec()
+
+            # Allocate vectors for the debug output
+            if self.debug:
+                self.res = self.assembler.createVec()
+                self.Av = self.assembler.createVec()
+                self.one = self.assembler.createVec()
+                self.one.getArray()[:] = 1.0
+                self.debug_counter = 0
 
             # Set up Jacobi-Davidson eigensolver:
             # Create the operator with given matrix and multigrid preconditioner
@@ -153,7 +212,9 @@ class FrequencyConstr:
             self.jd = TACS.JacobiDavidson(
                 self.oper, self.num_eigenvalues, self.max_jd_size, self.max_gmres_size
             )
-            self.jd.setTolerances(eig_rtol=1e-6, eig_atol=1e-6, rtol=1e-6, atol=1e-12)
+            self.jd.setTolerances(
+                eig_rtol=self.eig_rtol, eig_atol=1e-6, rtol=1e-6, atol=1e-12
+            )
             self.jd.setThetaCutoff(0.01)
 
             # Compute non-design matrices
@@ -165,6 +226,9 @@ class FrequencyConstr:
                     indices, mscale=self.mscale, kscale=self.kscale, save_f5=True
                 )
 
+        # The eigenpairs are about to change, so the saved g(rho) is stale
+        self.g_rho_valid = False
+
         # Assemble the mass matrix
         self.assembler.assembleMatType(TACS.MASS_MATRIX, self.mmat)
 
@@ -176,14 +240,14 @@ class FrequencyConstr:
         # Assemble the stiffness matrix
         self.assembler.assembleMatType(TACS.STIFFNESS_MATRIX, self.Amat)
 
-        # Apply non-design mass to M and K
-        if self.add_non_design_mass:
-            self.addNonDesignMat(self.mmat, self.Amat)
-
-        # Assemble A matrix for the simple eigenvalue problem and apply bcs
+        # Assemble A matrix for the simple eigenvalue problem
         # A = K - lambda0*M
         self.Amat.axpy(-self.lambda0, self.mmat)
 
+        # Apply non-design mass and stiffness to A
+        if self.add_non_design_mass:
+            self.addNonDesignMat(self.Amat)
+
         # We may shift the eigenvalues of A by adding value to diagonal entries:
         # A <- A - (old-1.0)*I
         # so that all eigenvalues for A are likely to be positive (and no smaller than 1.0)
@@ -202,6 +266,14 @@ class FrequencyConstr:
         """
         Solve the eigenvalue problem
         """
+        # Solve inexactly in early iterations if requested
+        if self.eig_rtol_init is not None:
+            eig_rtol = max(self.eig_rtol, self.eig_rtol_init * 0.5**self.num_evals)
+            self.jd.setTolerances(
+                eig_rtol=eig_rtol, eig_atol=1e-6, rtol=1e-6, atol=1e-12
+            )
+        self.num_evals += 1
+
         self.jd.setRecycle(self.num_eigenvalues)
         self.jd.solve(print_flag=True, print_level=1)
 
@@ -244,13 +316,7 @@ class FrequencyConstr:
                     self.eig[i], error = self.jd.extractEigenvector(i, self.eigv[i])
                 self.assembler.setVariables(self.eigv[nconvd])
 
-                flag_fail = (
-                    TACS.OUTPUT_CONNECTIVITY
-                    | TACS.OUTPUT_NODES
-                    | TACS.OUTPUT_DISPLACEMENTS
-                    | TACS.OUTPUT_EXTRAS
-                )
-                f5_fail = TACS.ToFH5(self.assembler, TACS.SOLID_ELEMENT, flag_fail)
+                f5_fail = TACS.ToFH5(self.assembler, TACS.SOLID_ELEMENT, self.f5_flag)
                 f5_fail.writeToFile(os.path.join(self.prefix, "fail.f5"))
 
                 raise ValueError(msg)
@@ -259,74 +325,57 @@ class FrequencyConstr:
         for i in range(self.num_eigenvalues):
             self.eig[i], error = self.jd.extractEigenvector(i, self.eigv[i])
 
-        # Adjust eigenvalues and shift matrices back:
-        # A <- A - I + old*I
-        # i.e. now A = K - lambda0*M
-        for i in range(self.num_eigenvalues):
-            self.eig[i] += self.old_min_eigval - 1.0
-        self.Amat.addDiag(self.old_min_eigval - 1.0)
-        self.assembler.applyMatBCs(self.Amat)
+        # Adjust eigenvalues back to those of K - lambda0*M:
+        # eig <- eig - I + old*I
+        # A is not shifted back since it is reassembled in the next evaluation
+        shift = 1.0 - self.old_min_eigval
+        self.eig -= shift
 
         # Set the shift value for next optimization iteration
         self.old_min_eigval = self.eig[0]  # smallest eigenvalue
 
         # Debug: print out residuals
-        debug_initialized = 0
-        if debug_initialized == 0:
-            debug_initialized = 1
-            res = self.assembler.createVec()
-            one = self.assembler.createVec()
-            Av = self.assembler.createVec()
-            one_arr = one.getArray()
-            one_arr[:] = 1.0
-            debug_counter = 0
-
+        if self.debug:
             residual = np.zeros(self.num_eigenvalues)
             eigvec_l1 = np.zeros(self.num_eigenvalues)
             eigvec_l2 = np.zeros(self.num_eigenvalues)
 
-        for i in range(self.num_eigenvalues):
-            self.Amat.mult(self.eigv[i], Av)  # Compute Av
+            for i in range(self.num_eigenvalues):
+                self.Amat.mult(self.eigv[i], self.Av)  # Compute Av
 
-            res.copyValues(Av)
-            res.axpy(-self.eig[i], self.eigv[i])  # Compute res = Av - lambda*v
+                self.res.copyValues(self.Av)
+                # Compute res = Av - lambda*v, where A is still shifted
+                self.res.axpy(-(self.eig[i] + shift), self.eigv[i])
 
-            residual[i] = res.norm()
-            eigvec_l1[i] = self.eigv[i].dot(one)  # Compute l1 norm
-            eigvec_l2[i] = self.eigv[i].dot(self.eigv[i]) ** 0.5  # Compute l2 norm
+                residual[i] = self.res.norm()
+                eigvec_l1[i] = self.eigv[i].dot(self.one)  # Compute l1 norm
+                eigvec_l2[i] = self.eigv[i].norm()  # Compute l2 norm
 
-        debug_counter += 1
-        if self.assembler.getMPIComm().rank == 0:
-            print("Optimization iteration:{:4d}".format(debug_counter))
-            print(
-                "{:4s}{:15s}{:15s}{:15s}".format(
-                    "No", "Eig Res", "Eigv l1 norm", "Eigv l2 norm"
-                )
-            )
-            for i in range(self.num_eigenvalues):
+            self.debug_counter += 1
+            if self.comm.rank == 0:
+                print("Optimization iteration:{:4d}".format(self.debug_counter))
                 print(
-                    "{:4d}{:15.5e}{:15.5e}{:15.5e}".format(
-                        i, residual[i], eigvec_l1[i], eigvec_l2[i]
+                    "{:4s}{:15s}{:15s}{:15s}".format(
+                        "No", "Eig Res", "Eigv l1 norm", "Eigv l2 norm"
                     )
                 )
+                for i in range(self.num_eigenvalues):
+                    print(
+                        "{:4d}{:15.5e}{:15.5e}{:15.5e}".format(
+                            i, residual[i], eigvec_l1[i], eigvec_l2[i]
+                        )
+                    )
 
         # Set first eigenvector as state variable for visualization
         self.assembler.setVariables(self.eigv[0])
 
-        # Scale eigenvalues for a better KS approximation
-        self.eig[:] *= self.eig_scale
-
-        # Compute the minimal eigenvalue
-        eig_min = np.min(self.eig)
-
-        # Compute KS aggregation
-        self.eta = np.exp(-self.ksrho * (self.eig - eig_min))
+        # Compute the KS aggregation of the scaled eigenvalues, the scaling
+        # gives a better KS approximation
+        eig_min = self.eig_scale * np.min(self.eig)
+        self.eta = np.exp(-self.ksrho * (self.eig_scale * self.eig - eig_min))
         self.beta = np.sum(self.eta)
         ks = eig_min - np.log(self.beta) / self.ksrho
-        self.eta = self.eta / self.beta
-
-        # Scale eigenvalue back
-        self.eig[:] /= self.eig_scale
+        self.eta /= self.beta
 
         # Print values
         if self.comm.rank == 0:
@@ -347,30 +396,16 @@ class FrequencyConstr:
         # Zero out the gradient vector
         dcdrho.zeroEntries()
 
-        for i in range(self.num_eigenvalues):
-            # Compute the coefficient
-            coeff = self.eta[i] * self.eig_scale
-
-            # Compute gradient of eigenvalue
-            self.deig[i].zeroEntries()
-            self.assembler.addMatDVSensInnerProduct(
-                coeff, TACS.STIFFNESS_MATRIX, self.eigv[i], self.eigv[i], self.deig[i]
-            )
-
-            self.assembler.addMatDVSensInnerProduct(
-                -coeff * self.lambda0,
-                TACS.MASS_MATRIX,
-                self.eigv[i],
-                self.eigv[i],
-                self.deig[i],
-            )
+        # Add the contribution of the gradient of eigenvalues
+        self.addEigSens(1.0, dcdrho)
 
-            # Make sure the vector is properly distributed over all processors
-            self.deig[i].beginSetValues(op=TACS.ADD_VALUES)
-            self.deig[i].endSetValues(op=TACS.ADD_VALUES)
+        # Make sure the vector is properly distributed over all processors
+        dcdrho.beginSetValues(op=TACS.ADD_VALUES)
+        dcdrho.endSetValues(op=TACS.ADD_VALUES)
 
-            # Add the contribution
-            dcdrho.axpy(1.0, self.deig[i])
+        # Save g(rho) so that qn_correction doesn't need to recompute it
+        self.g_rho.copyValues(dcdrho)
+        self.g_rho_valid = True
 
         # Compute gradient norm
         norm = dcdrho.norm()
@@ -380,6 +415,30 @@ class FrequencyConstr:
         self.dcdrho = dcdrho
         return
 
+    def addEigSens(self, alpha, vec):
+        """
+        Add the gradient of the spectral aggregate, evaluated at the current
+        design variables in the assembler, to vec:
+
+        vec <- vec + alpha * sum_k eta_k phi^T dAdx phi
+
+        The caller is responsible for distributing vec over all processors
+        """
+        # Add all the stiffness contributions first, then all the mass
+        # contributions, instead of alternating between the two matrix types
+        coeff_k = alpha * self.eig_scale * self.eta
+        coeff_m = -self.lambda0 * coeff_k
+        for i in range(self.num_eigenvalues):
+            self.assembler.addMatDVSensInnerProduct(
+                coeff_k[i], TACS.STIFFNESS_MATRIX, self.eigv[i], self.eigv[i], vec
+            )
+        for i in range(self.num_eigenvalues):
+            self.assembler.addMatDVSensInnerProduct(
+                coeff_m[i], TACS.MASS_MATRIX, self.eigv[i], self.eigv[i], vec
+            )
+
+        return
+
     def qn_correction(self, zero_idx, z, s, y):
         """
         Update y:
@@ -400,8 +459,9 @@ class FrequencyConstr:
         dv == Fx
 
         Inputs:
-            zero_idx (int list): indices to-be-zeroed in order to compute
-                                 the Hessian-vector product for reduced problem
+            zero_idx (int array): indices to-be-zeroed in order to compute
+                                  the Hessian-vector product for reduced
+                                  problem, or None
             s (PVec): unfiltered update step
             z (array-like): multipliers for dense constraints
 
@@ -417,13 +477,16 @@ class FrequencyConstr:
         self.fltr.applyFilter(TMR.convertPVecToVec(s), self.svec)
 
         """[1.5] Zero out entries in svec if called by a reduced problem"""
-        if zero_idx:
+        if zero_idx is not None:
             self.svec_vals[zero_idx] = 0.0
 
         """[2] Compute update <- P * svec by finite differencing"""
         # Finite difference step length for computing second order
         # derivative of stiffness matrix
-        h = 1e-8
+        if self.qn_central_difference:
+            h = 1e-6
+        else:
+            h = 1e-8
 
         # Save original rho for later use
         self.assembler.getDesignVars(self.rho_original)
@@ -433,50 +496,45 @@ class FrequencyConstr:
         self.rho.axpy(h, self.svec)
         self.assembler.setDesignVars(self.rho)
 
-        # Prepare the temp vector
+        # Compute temp <- g(rho + h*s)
         self.temp.zeroEntries()
+        self.addEigSens(1.0, self.temp)
 
-        for i in range(self.num_eigenvalues):
-            # Compute g(rho + h*s) for d2Kdx2
-            coeff1 = self.eta[i] * self.eig_scale
-            self.assembler.addMatDVSensInnerProduct(
-                coeff1, TACS.STIFFNESS_MATRIX, self.eigv[i], self.eigv[i], self.temp
-            )
-
-            # Compute g(rho + h*s) for d2Mdx2
-            coeff2 = -self.eta[i] * self.lambda0 * self.eig_scale
-            self.assembler.addMatDVSensInnerProduct(
-                coeff2, TACS.MASS_MATRIX, self.eigv[i], self.eigv[i], self.temp
-            )
+        # Compute temp <- g(rho + h*s) - g(rho - h*s) for central difference
+        if self.qn_central_difference:
+            self.rho.copyValues(self.rho_original)
+            self.rho.axpy(-h, self.svec)
+            self.assembler.setDesignVars(self.rho)
+            self.addEigSens(-1.0, self.temp)
 
         # set density back to original
         self.assembler.setDesignVars(self.rho_original)
 
-        for i in range(self.num_eigenvalues):
-            # Compute g(rho + h*s) - g(rho) for d2Kdx2
-            coeff1 = self.eta[i] * self.eig_scale
-            self.assembler.addMatDVSensInnerProduct(
-                -coeff1, TACS.STIFFNESS_MATRIX, self.eigv[i], self.eigv[i], self.temp
-            )
-
-            # Compute g(rho + h*s) - g(rho) for d2Mdx2
-            coeff2 = -self.eta[i] * self.lambda0 * self.eig_scale
-            self.assembler.addMatDVSensInnerProduct(
-                -coeff2, TACS.MASS_MATRIX, self.eigv[i], self.eigv[i], self.temp
-            )
+        # Recompute g(rho) for the forward difference if the gradient was not
+        # evaluated with the current eigenpairs
+        if not self.qn_central_difference and not self.g_rho_valid:
+            self.g_rho.zeroEntries()
+            self.addEigSens(1.0, self.g_rho)
+            self.g_rho.beginSetValues(op=TACS.ADD_VALUES)
+            self.g_rho.endSetValues(op=TACS.ADD_VALUES)
+            self.g_rho_valid = True
 
         # Distribute the temp vector
         self.temp.beginSetValues(op=TACS.ADD_VALUES)
         self.temp.endSetValues(op=TACS.ADD_VALUES)
 
-        # Prepare update vector
-        self.update.zeroEntries()
-
         # Finish computing P * svec
-        self.update.axpy(1.0 / h, self.temp)
+        self.update.copyValues(self.temp)
+        if self.qn_central_difference:
+            # P * svec = (g(rho + h*s) - g(rho - h*s)) / 2h
+            self.update.scale(0.5 / h)
+        else:
+            # P * svec = (g(rho + h*s) - g(rho)) / h
+            self.update.axpy(-1.0, self.g_rho)
+            self.update.scale(1.0 / h)
 
         """[2.5] Zero out entries in update if called by a reduced problem"""
-        if zero_idx:
+        if zero_idx is not None:
             self.update_vals[zero_idx] = 0.0
 
         """[Debug print]"""
@@ -496,7 +554,7 @@ class FrequencyConstr:
         # only perform such update when curvature condition is satisfied
         if curvature > 0:
             self.fltr.applyTranspose(self.update, self.update)  # update <- F*T update
-            if zero_idx:
+            if zero_idx is not None:
                 self.update_vals[zero_idx] = 0.0
             y_wrap = TMR.convertPVecToVec(y)  # prepare y
             y_wrap.axpy(z[0], self.update)  # y <- y + z * update
@@ -505,14 +563,17 @@ class FrequencyConstr:
         self.curvs.append(curvature)
 
         # Timer
-        self.qn_time.append(MPI.Wtime() - t_start)
+        self.qn_time += MPI.Wtime() - t_start
+        self.qn_count += 1
         return
 
     def getQnUpdateCurvs(self):
         return self.curvs
 
     def getAveragedQnTime(self):
-        return np.average(self.qn_time)
+        if self.qn_count == 0:
+            return np.nan
+        return self.qn_time / self.qn_count
 
     def computeNonDesignMat(self, indices, mscale, kscale, save_f5=False):
         """
@@ -521,35 +582,36 @@ class FrequencyConstr:
         material is modeled by M0 and K0, where
         M0 = M(dv[indices] = 1.0) * mscale
         K0 = K(dv[indices] = 1.0) * kscale
+
+        These are constant, so only their contribution to the eigenvalue
+        problem A0 = K0 - lambda0*M0 is stored.
+
+        Note that the qn correction vectors self.rho and self.rho_original are
+        used as scratch space here
         """
 
         # Populate the non-design mass vector
-        dv_one = self.assembler.createDesignVec()
+        dv_one = self.rho
+        dv_one.zeroEntries()
         if indices:
             dv_one.getArray()[indices] = 1.0
 
         # Back up design variable
-        dv_backup = self.assembler.createDesignVec()
+        dv_backup = self.rho_original
         self.assembler.getDesignVars(dv_backup)
 
         # Assemble non-design mass and stiffness matrix
-        self.m0mat = self.assembler.createMat()
-        self.k0mat = self.assembler.createMat()
+        m0mat = self.assembler.createMat()
+        self.a0mat = self.assembler.createMat()
         self.assembler.setDesignVars(dv_one)
-        self.assembler.assembleMatType(TACS.MASS_MATRIX, self.m0mat)
-        self.assembler.assembleMatType(TACS.STIFFNESS_MATRIX, self.k0mat)
-        self.m0mat.scale(mscale)
-        self.k0mat.scale(kscale)
+        self.assembler.assembleMatType(TACS.MASS_MATRIX, m0mat)
+        self.assembler.assembleMatType(TACS.STIFFNESS_MATRIX, self.a0mat)
+        self.a0mat.scale(kscale)
+        self.a0mat.axpy(-self.lambda0 * mscale, m0mat)
 
         # Save geometry to f5
         if save_f5:
-            flag_m0 = (
-                TACS.OUTPUT_CONNECTIVITY
-                | TACS.OUTPUT_NODES
-                | TACS.OUTPUT_DISPLACEMENTS
-                | TACS.OUTPUT_EXTRAS
-            )
-            f5_m0 = TACS.ToFH5(self.assembler, TACS.SOLID_ELEMENT, flag_m0)
+            f5_m0 = TACS.ToFH5(self.assembler, TACS.SOLID_ELEMENT, self.f5_flag)
             f5_m0.writeToFile(os.path.join(self.prefix, "non_design_mass.f5"))
 
         # Set design variable back
@@ -557,14 +619,9 @@ class FrequencyConstr:
 
         return
 
-    def addNonDesignMat(self, mmat, kmat):
-        # Update mmat and apply boundary conditions
-        mmat.axpy(1.0, self.m0mat)
-        self.assembler.applyMatBCs(mmat)
-
-        # Update kmat and apply boundary conditions
-        kmat.axpy(1.0, self.k0mat)
-        self.assembler.applyMatBCs(mmat)
+    def addNonDesignMat(self, amat):
+        # Update amat, the boundary conditions are applied by the caller
+        amat.axpy(1.0, self.a0mat)
 
         return
 
@@ -636,6 +693,9 @@ def create_problem(
     max_gmres_size=30,
     mscale=10.0,
     kscale=1.0,
+    debug=False,
+    eig_rtol_init=None,
+    qn_central_difference=False,
 ):
     """
     Create the TMRTopoProblem object and set up the topology optimization problem.
@@ -653,6 +713,9 @@ def create_problem(
         nlevels (int): number of multigrid levels
         density (float): Density to use for the mass computation
         iter_offset (int): iteration counter offset
+        debug (bool): print out eigenvector residuals in the frequency constraint
+        eig_rtol_init (float): initial loose eigensolver tolerance, or None
+        qn_central_difference (bool): use central difference for qn correction
 
     Returns:
         TopoProblem: Topology optimization problem instance
@@ -671,16 +734,7 @@ def create_problem(
     assembler = problem.getAssembler()
 
     # Compute the fixed mass target
-    lx = len0 * AR  # mm
-    ly = len0  # mm
-    lz = len0  # mm
-    if domain == "lbracket":
-        ly = len0 * ratio
-    vol = lx * ly * lz
-    if domain == "lbracket":
-        S1 = lx * lz
-        S2 = lx * lz * (1.0 - ratio) ** 2
-        vol = (S1 - S2) * ly
+    _, _, _, vol = domain_dims(domain, len0, AR, ratio)
     m_fixed = vol_frac * (vol * density)
 
     # Add objective callback
@@ -706,6 +760,9 @@ def create_problem(
         max_gmres_size=max_gmres_size,
         mscale=mscale,
         kscale=kscale,
+        debug=debug,
+        eig_rtol_init=eig_rtol_init,
+        qn_central_difference=qn_central_difference,
     )
     problem.addConstraintCallback(
         1, 1, constr_callback.constraint, constr_callback.constraint_gradient
@@ -730,7 +787,18 @@ class ReducedProblem(ParOpt.Problem):
         fixed_dv_val=1.0,
         qn_correction_func=None,
         ncon=1,
+        save_snapshot_every=1,
+        snapshot_file=None,
     ):
+        """
+        Args:
+            save_snapshot_every (int): save a snapshot of the objective,
+                                       infeasibility and discreteness every
+                                       this many objective evaluations
+            snapshot_file (str): if given, each snapshot is also written to
+                                 this csv file, which stays open until
+                                 close() is called
+        """
         self.prob = original_prob
         self.assembler = self.prob.getAssembler()
         self.comm = self.assembler.getMPIComm()
@@ -752,20 +820,34 @@ class ReducedProblem(ParOpt.Problem):
         self.fixed_dv_idx = fixed_dv_idx
         self.fixed_dv_val = fixed_dv_val
 
-        # Compute the indices of fixed design variables, these indices
+        # Indices to be zeroed by the qn correction, stored as an array once
+        # rather than converted from the list at every correction
+        self.zero_idx = None
+        if self.fixed_dv_idx:
+            self.zero_idx = np.asarray(self.fixed_dv_idx, dtype=int)
+
+        # Compute the indices of free design variables, these indices
         # are with respect to the original full-sized problem
-        self.free_dv_idx = [
-            i for i in range(len(self._x)) if i not in self.fixed_dv_idx
-        ]
+        free_mask = np.ones(len(self._x), dtype=bool)
+        if self.zero_idx is not None:
+            free_mask[self.zero_idx] = False
+        self.free_dv_idx = np.flatnonzero(free_mask)
         self.nvars = len(self.free_dv_idx)
 
         # Initial dv - can be set by calling setInitDesignVars()
         self.xinit = None
 
         self.num_obj_evals = 0
-        self.save_snapshot_every = 1
+        self.save_snapshot_every = save_snapshot_every
         self.snapshot = {"iter": [], "obj": [], "infeas": [], "discreteness": []}
 
+        # Only the root processor writes the snapshot file, the header is
+        # written once here and each snapshot is appended to it later
+        self.snapshot_file = None
+        if snapshot_file is not None and self.comm.rank == 0:
+            self.snapshot_file = open(snapshot_file, "w")
+            self.snapshot_file.write(",".join(self.snapshot.keys()) + "\n")
+
         super().__init__(self.comm, self.nvars, self.ncon)
         return
 
@@ -800,9 +882,15 @@ class ReducedProblem(ParOpt.Problem):
             self.snapshot["iter"].append(self.num_obj_evals)
             self.snapshot["obj"].append(fobj)
             self.snapshot["infeas"].append(np.max([-con[0], 0]))  # hard-coded
-            x_g = self.comm.allgather(np.array(x))
-            x_g = np.concatenate(x_g)
-            self.snapshot["discreteness"].append(np.dot(x_g, 1.0 - x_g) / len(x_g))
+
+            self.snapshot["discreteness"].append(
+                compute_discreteness(self.comm, np.asarray(x))
+            )
+
+            if self.snapshot_file is not None:
+                self.snapshot_file.write(
+                    ",".join(str(val[-1]) for val in self.snapshot.values()) + "\n"
+                )
 
         self.num_obj_evals += 1
 
@@ -833,7 +921,7 @@ class ReducedProblem(ParOpt.Problem):
 
         if self.fixed_dv_idx:
             DV[self.fixed_dv_idx] = val
-        if self.free_dv_idx:
+        if self.free_dv_idx.size:
             DV[self.free_dv_idx] = reduDV[:]
 
         return
@@ -842,7 +930,7 @@ class ReducedProblem(ParOpt.Problem):
         """
         Convert the full-sized design vector to reduced design vector
         """
-        if self.free_dv_idx:
+        if self.free_dv_idx.size:
             reduDV[:] = DV[self.free_dv_idx]
 
         return
@@ -854,47 +942,59 @@ class ReducedProblem(ParOpt.Problem):
             self.reduDVtoDV(y, self._y, fixed_val=0.0)
 
             # Update y and copy back
-            self.qn_correction_func(self.fixed_dv_idx, z, self._s, self._y)
+            self.qn_correction_func(self.zero_idx, z, self._s, self._y)
             self.DVtoreduDV(self._y, y)
         return
 
     def get_snapshot(self):
         return self.snapshot
 
+    def close(self):
+        """
+        Close the snapshot file, if there is one
+        """
+        if self.snapshot_file is not None:
+            self.snapshot_file.close()
+            self.snapshot_file = None
+        return
 
-def getFixedDVIndices(forest, domain, len0, AR, ratio):
-    """
-    Get indices for fixed design variables
-    """
-
-    fixed_dv_idx = []
 
-    # Compute geometric parameters
-    lx = len0 * AR
-    ly = len0
-    lz = len0
-    if domain == "lbracket":
-        ly = len0 * ratio
+def find_owned_nodes(forest, lower, upper, strict=False):
+    """
+    Return the indices of the locally owned nodes, with respect to the first
+    owned node, whose coordinates are within the given bounds
 
-    # Get nodal locations
-    Xpts = forest.getPoints()
+    Args:
+        forest (OctForest): Forest object
+        lower (tuple): lower bounds xmin, ymin, zmin
+        upper (tuple): upper bounds xmax, ymax, zmax
+        strict (bool): exclude the nodes on the bounds
+    """
 
     # Note: the local nodes are organized as follows:
     # |--- dependent nodes -- | ext_pre | -- owned local -- | - ext_post -|
+    Xpts = forest.getPoints()
+    offset = forest.getExtPreOffset()
+    X = np.ascontiguousarray(Xpts[offset:])
 
-    # Get number of local nodes in the current processor
-    n_local_nodes = Xpts.shape[0]
+    # Compare all the coordinates of each node at once
+    if strict:
+        mask = np.all((lower < X) & (X < upper), axis=1)
+    else:
+        mask = np.all((lower <= X) & (X <= upper), axis=1)
 
-    # Get numbder of dependent nodes
-    _ptr, _conn, _weights = forest.getDepNodeConn()
+    return np.flatnonzero(mask)
 
-    # Get number of ext_pre nodes
-    n_ext_pre = forest.getExtPreOffset()
 
-    # Get numbder of own nodes:
-    offset = n_ext_pre
+def getFixedDVIndices(forest, domain, len0, AR, ratio):
+    """
+    Get indices for fixed design variables
+    """
+
+    # Compute geometric parameters
+    lx, ly, lz, _ = domain_dims(domain, len0, AR, ratio)
 
-    # # Loop over all owned nodes and set non-design mass values
+    # Find the owned nodes within the non-design mass region
     tol = 1e-6  # Make sure our ranges are inclusive
     depth = 0.1  # depth for non-design mass
     if domain == "cantilever":
@@ -932,12 +1032,9 @@ def getFixedDVIndices(forest, domain, len0, AR, ratio):
     else:
         raise ValueError("[Error]Unsupported domain type for non-design mass!")
 
-    for i in range(offset, n_local_nodes):
-        x, y, z = Xpts[i]
-        if xmin < x < xmax:
-            if ymin < y < ymax:
-                if zmin < z < zmax:
-                    fixed_dv_idx.append(i - offset)
+    lower = (xmin, ymin, zmin)
+    upper = (xmax, ymax, zmax)
+    fixed_dv_idx = find_owned_nodes(forest, lower, upper, strict=True).tolist()
 
     return fixed_dv_idx
 
@@ -973,12 +1070,9 @@ class ReduOmAnalysis(om.ExplicitComponent):
 
         # Compute sizes and offsets
         local_size = len(x0)
-        sizes = [0] * comm.size
-        offsets = [0] * comm.size
-        sizes = comm.allgather(local_size)
-        if comm.size > 1:
-            for i in range(1, comm.size):
-                offsets[i] = offsets[i - 1] + sizes[i - 1]
+        sizes = np.empty(comm.size, dtype=np.int64)
+        comm.Allgather(np.array([local_size], dtype=np.int64), sizes)
+        offsets = np.concatenate(([0], np.cumsum(sizes[:-1])))
         self.sizes = sizes
         self.offsets = offsets
 
@@ -986,9 +1080,9 @@ class ReduOmAnalysis(om.ExplicitComponent):
         self.ncon = self.problem.getNumCons()
 
         # Compute some indices and dimensions
-        self.local_size = self.sizes[self.comm.rank]
-        self.global_size = np.sum(self.sizes)
-        self.start = self.offsets[self.comm.rank]
+        self.local_size = int(self.sizes[self.comm.rank])
+        self.global_size = int(self.sizes.sum())
+        self.start = int(self.offsets[self.comm.rank])
         self.end = self.start + self.local_size
 
         # Allocate paropt vectors
@@ -998,6 +1092,35 @@ class ReduOmAnalysis(om.ExplicitComponent):
         for i in range(self.ncon):
             self.A.append(self.problem.createDesignVec())
 
+        # Allocate the buffers for gathering the gradient and the constraint
+        # jacobian in a single collective. The local gradients are stored as
+        # the columns of local_pack, so that the blocks gathered from each
+        # processor are the consecutive rows of global_pack
+        nrows = self.ncon + 1
+        self.counts = nrows * np.array(self.sizes, dtype=np.int32)
+        self.displs = nrows * np.array(self.offsets, dtype=np.int32)
+        self.local_pack = np.empty((self.local_size, nrows))
+        self.global_pack = np.empty((self.global_size, nrows))
+
+        # Allocate the buffers for scattering the design variables
+        self.x_sizes = np.array(self.sizes, dtype=np.int32)
+        self.x_offsets = np.array(self.offsets, dtype=np.int32)
+        self.x_global = np.empty(self.global_size)
+
+        # If the design vector exposes its storage, scatter straight into it,
+        # otherwise scatter into a separate buffer and copy it over
+        try:
+            self.x_local = np.asarray(memoryview(self.x))
+            self.x_is_view = (
+                self.x_local.dtype == float
+                and self.x_local.size == self.local_size
+                and self.x_local.flags.writeable
+            )
+        except TypeError:
+            self.x_is_view = False
+        if not self.x_is_view:
+            self.x_local = np.empty(self.local_size)
+
         return
 
     def setup(self):
@@ -1011,58 +1134,59 @@ class ReduOmAnalysis(om.ExplicitComponent):
         return
 
     def compute(self, inputs, outputs):
-        # Broadcase x from root to all processor
-        # In this way we only use optimization result from
-        # root and implicitly discard results from any other
-        # optimizer to prevent potential inconsistency
-        if self.comm.rank == 0:
-            x = inputs["x"]
-        else:
-            x = None
-        x = self.comm.bcast(x, root=0)
-
         # Each processor only use its owned part to evaluate func and grad
-        self.x[:] = x[self.start : self.end]
+        self.scatterDesignVars(inputs)
         fail, fobj, cons = self.problem.evalObjCon(self.x)
 
+        # Make sure all processors fail together
+        fail = self.comm.allreduce(int(fail), op=MPI.LOR)
+
         if fail:
             raise RuntimeError("Failed to evaluate objective and constraints!")
         else:
             outputs["obj"] = fobj
             outputs["con"] = cons[0]
 
-        # Barrier here because we don't do block communication
-        self.comm.Barrier()
-
         return
 
     def compute_partials(self, inputs, partials):
-        # Broadcase x from root to all processor
-        # In this way we only use optimization result from
-        # root and implicitly discard results from any other
-        # optimizer to prevent potential inconsistency
-        if self.comm.rank == 0:
-            x = inputs["x"]
-        else:
-            x = None
-        x = self.comm.bcast(x, root=0)
-
         # Each processor only use its owned part to evaluate func and grad
-        self.x[:] = x[self.start : self.end]
+        self.scatterDesignVars(inputs)
         fail = self.problem.evalObjConGradient(self.x, self.g, self.A)
 
+        # Make sure all processors fail together
+        fail = self.comm.allreduce(int(fail), op=MPI.LOR)
+
         if fail:
             raise RuntimeError("Failed to evaluate objective and constraints!")
         else:
-            global_g = self.comm.allgather(np.array(self.g))
-            global_g = np.concatenate(global_g)
-            global_A = []
+            self.local_pack[:, 0] = self.g
             for i in range(self.ncon):
-                global_A.append(self.comm.allgather(np.array(self.A[i])))
-                global_A[i] = np.concatenate(global_A[i])
+                self.local_pack[:, i + 1] = self.A[i]
+            self.comm.Allgatherv(
+                self.local_pack,
+                [self.global_pack, self.counts, self.displs, MPI.DOUBLE],
+            )
+
+            partials["obj", "x"] = self.global_pack[:, 0]
+            partials["con", "x"] = self.global_pack[:, 1:].T
+        return
+
+    def scatterDesignVars(self, inputs):
+        """
+        Scatter x from root to all processors and set the local part
+        In this way we only use optimization result from
+        root and implicitly discard results from any other
+        optimizer to prevent potential inconsistency
+        """
+        sendbuf = None
+        if self.comm.rank == 0:
+            np.copyto(self.x_global, inputs["x"])
+            sendbuf = [self.x_global, self.x_sizes, self.x_offsets, MPI.DOUBLE]
+        self.comm.Scatterv(sendbuf, self.x_local, root=0)
+        if not self.x_is_view:
+            self.x[:] = self.x_local
 
-            partials["obj", "x"] = global_g
-            partials["con", "x"] = global_A
         return
 
     def globalVecToLocalvec(self, global_vec, local_vec):
@@ -1097,10 +1221,17 @@ class GeneralEigSolver:
         self.kmat = self.assembler.createMat()
         self.mmat = self.assembler.createMat()
 
-        # Allocate space for the nodal density, eigenvalues and eigenvectors
-        self.rho = self.assembler.createDesignVec()
+        # The nodal density, eigenvectors and temp vectors to check the
+        # residuals are full-sized, so they are allocated on first use
+        self.rho = None
+        self.evecs = None
+        self.MatVec = None
+        self.temp = None
         self.evals = np.zeros(N)
-        self.evecs = [self.assembler.createVec() for _ in range(N)]
+
+        # Version or hash of the design variable that self.rho was
+        # filtered from
+        self.x_key = None
 
         # Create operator for the generalized eigenvalue problem
         self.oper = TACS.JDFrequencyOperator(
@@ -1112,11 +1243,16 @@ class GeneralEigSolver:
         self.jd.setTolerances(eig_rtol=1e-6, eig_atol=1e-8, rtol=1e-12, atol=1e-15)
         self.jd.setRecycle(self.N)
 
-        # Temp vectors to check residual
-        self.MatVec = self.assembler.createVec()
-        self.temp = self.assembler.createVec()
         self.res = np.zeros(N)
 
+        # Non-design mass and stiffness matrices and the design vectors used
+        # to assemble them, allocated on first use
+        self.m0mat = None
+        self.k0mat = None
+        self.dv_one = None
+        self.dv_backup = None
+        self.non_design_key = None
+
         return
 
     def compute(
@@ -1126,6 +1262,7 @@ class GeneralEigSolver:
         non_design_mass_indices=None,
         mscale=1.0,
         kscale=1.0,
+        x_version=None,
     ):
         """
         Take in x, update the design variable in the assembler, assemble
@@ -1137,10 +1274,37 @@ class GeneralEigSolver:
                                         problem as follows:
                                         M <- M + M0, M0 = M(dv[indices] = 1.0) * mscale
                                         K <- K + K0, K0 = K(dv[indices] = 1.0) * kscale
+            x_version (int): if given, a version number of x that the caller keeps
+                             identical on all processors and changes whenever x
+                             changes, this avoids hashing x and reducing the result
         """
 
-        # Update the assembler with x
-        self.filter.applyFilter(TMR.convertPVecToVec(x), self.rho)
+        if self.evecs is None:
+            self.rho = self.assembler.createDesignVec()
+            self.evecs = [self.assembler.createVec() for _ in range(self.N)]
+            self.MatVec = self.assembler.createVec()
+            self.temp = self.assembler.createVec()
+
+        # Only filter x again if it has changed since the last call. The
+        # filter is collective so all processors must agree: a version given
+        # by the caller already does, otherwise the hash of the local entries
+        # is compared and the result is reduced once. The first call always
+        # filters
+        x_vec = TMR.convertPVecToVec(x)
+        if x_version is not None:
+            x_key = x_version
+            changed = x_key != self.x_key
+        else:
+            x_key = hashlib.sha1(x_vec.getArray()).digest()
+            changed = x_key != self.x_key
+            if self.x_key is not None:
+                changed = self.assembler.getMPIComm().allreduce(changed, op=MPI.LOR)
+        if changed:
+            self.filter.applyFilter(x_vec, self.rho)
+            self.x_key = x_key
+
+        # Update the assembler with x, the design variables are always set
+        # since the assembler is shared with the topology problem
         self.assembler.setDesignVars(self.rho)
 
         # Update matrices and factor the multigrid preconditioner
@@ -1149,35 +1313,43 @@ class GeneralEigSolver:
 
         # Update M and K, if specified
         if add_non_design_mass:
-            indices = non_design_mass_indices
-
-            # Populate the non-design mass vector
-            dv_one = self.assembler.createDesignVec()
-            if indices:
-                dv_one.getArray()[indices] = 1.0
-
-            # Back up design variable
-            dv_backup = self.assembler.createDesignVec()
-            self.assembler.getDesignVars(dv_backup)
-
-            # Assemble non-design mass and stiffness matrix
-            m0mat = self.assembler.createMat()
-            k0mat = self.assembler.createMat()
-            self.assembler.setDesignVars(dv_one)
-            self.assembler.assembleMatType(TACS.MASS_MATRIX, m0mat)
-            self.assembler.assembleMatType(TACS.STIFFNESS_MATRIX, k0mat)
-            m0mat.scale(mscale)
-            k0mat.scale(kscale)
-
-            # Set design variable back
-            self.assembler.setDesignVars(dv_backup)
+            indices = None
+            if non_design_mass_indices is not None:
+                indices = np.asarray(non_design_mass_indices, dtype=np.intp)
+
+            if self.m0mat is None:
+                self.m0mat = self.assembler.createMat()
+                self.k0mat = self.assembler.createMat()
+                self.dv_one = self.assembler.createDesignVec()
+                self.dv_backup = self.assembler.createDesignVec()
+
+            # The unscaled M0 and K0 don't depend on x, so only assemble them
+            # again if the indices have changed since the last call
+            key = b"" if indices is None else indices.tobytes()
+            if key != self.non_design_key:
+                # Populate the non-design mass vector
+                self.dv_one.zeroEntries()
+                if indices is not None and indices.size:
+                    self.dv_one.getArray()[indices] = 1.0
+
+                # Back up design variable
+                self.assembler.getDesignVars(self.dv_backup)
+
+                # Assemble non-design mass and stiffness matrix
+                self.assembler.setDesignVars(self.dv_one)
+                self.assembler.assembleMatType(TACS.MASS_MATRIX, self.m0mat)
+                self.assembler.assembleMatType(TACS.STIFFNESS_MATRIX, self.k0mat)
+
+                # Set design variable back
+                self.assembler.setDesignVars(self.dv_backup)
+                self.non_design_key = key
 
             # Update kmat
-            self.kmat.axpy(1.0, k0mat)
+            self.kmat.axpy(kscale, self.k0mat)
             self.assembler.applyMatBCs(self.kmat)
 
             # Update mmat
-            self.mmat.axpy(1.0, m0mat)
+            self.mmat.axpy(mscale, self.m0mat)
             self.assembler.applyMatBCs(self.mmat)
 
         self.mg.assembleMatType(TACS.STIFFNESS_MATRIX)
@@ -1193,8 +1365,7 @@ class GeneralEigSolver:
 
         # Check residuals
         for i in range(self.N):
-            self.kmat.mult(self.evecs[i], self.MatVec)  # Compute K*v
-            self.temp.copyValues(self.MatVec)
+            self.kmat.mult(self.evecs[i], self.temp)  # Compute K*v
             self.mmat.mult(self.evecs[i], self.MatVec)  # Compute M*v
             self.temp.axpy(-self.evals[i], self.MatVec)
             self.res[i] = self.temp.norm()
@@ -1216,17 +1387,12 @@ def find_indices(
     zmax=None,
 ):
     """
-    Return indices for the design vector such that:
+    Return indices for the design vector, as an int32 array, such that:
     xmin, ymin, zmin <= x, y, z <= xmax, ymax, zmax
     """
-    indices = []
 
     # Compute geometric parameters
-    lx = len0 * AR
-    ly = len0
-    lz = len0
-    if domain == "lbracket":
-        ly = len0 * ratio
+    lx, ly, lz, _ = domain_dims(domain, len0, AR, ratio)
 
     # Set max to default
     if not xmax:
@@ -1236,28 +1402,10 @@ def find_indices(
     if not zmax:
         zmax = lz
 
-    # Get nodal locations
-    Xpts = forest.getPoints()
-
-    # Note: the local nodes are organized as follows:
-    # |--- dependent nodes -- | ext_pre | -- owned local -- | - ext_post -|
-
-    # Get number of local nodes in the current processor
-    n_local_nodes = Xpts.shape[0]
-
-    # Get number of ext_pre nodes
-    n_ext_pre = forest.getExtPreOffset()
-
-    # Get numbder of own nodes:
-    offset = n_ext_pre
-
-    # # Loop over all owned nodes and set non-design mass values
-    for i in range(offset, n_local_nodes):
-        x, y, z = Xpts[i]
-        if xmin <= x <= xmax:
-            if ymin <= y <= ymax:
-                if zmin <= z <= zmax:
-                    indices.append(i - offset)
+    # Find the owned nodes within the bounds
+    lower = (xmin, ymin, zmin)
+    upper = (xmax, ymax, zmax)
+    indices = find_owned_nodes(forest, lower, upper).astype(np.int32)
 
     return indices
 
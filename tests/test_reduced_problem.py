@@ -0,0 +1,58 @@
+import os
+import sys
+import types
+import numpy as np
+from mpi4py import MPI
+from paropt import ParOpt
+import unittest
+
+qn_dir = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..",
+    "examples",
+    "topology_optimization",
+    "qn-correction",
+)
+
+
+class DesignVecProblem(ParOpt.Problem):
+    def __init__(self, nvars):
+        super().__init__(MPI.COMM_SELF, nvars, 1)
+
+
+@unittest.skipUnless(os.path.isdir(qn_dir), "qn-correction examples not available")
+class ReducedProblemTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        sys.path.insert(0, os.path.join(qn_dir, "eigenvalue"))
+        sys.path.insert(0, os.path.join(qn_dir, "refactor_frequency"))
+        from refactor_utils_freq import ReducedProblem
+
+        cls.ReducedProblem = ReducedProblem
+
+    def setUp(self):
+        # Only the index bookkeeping is needed by the conversions
+        self.redu = types.SimpleNamespace(
+            fixed_dv_idx=[0, 3],
+            fixed_dv_val=1.0,
+            free_dv_idx=np.array([1, 2, 4]),
+        )
+        self.nvars = 5
+
+    def check_conversion(self, DV):
+        reduDV = np.array([0.2, 0.4, 0.6])
+        self.ReducedProblem.reduDVtoDV(self.redu, reduDV, DV)
+        np.testing.assert_allclose(np.array(DV), [1.0, 0.2, 0.4, 1.0, 0.6])
+
+        self.ReducedProblem.reduDVtoDV(self.redu, reduDV, DV, fixed_val=0.0)
+        np.testing.assert_allclose(np.array(DV), [0.0, 0.2, 0.4, 0.0, 0.6])
+
+        out = np.zeros(3)
+        self.ReducedProblem.DVtoreduDV(self.redu, DV, out)
+        np.testing.assert_allclose(out, reduDV)
+
+    def test_ndarray(self):
+        self.check_conversion(np.zeros(self.nvars))
+
+    def test_pvec(self):
+        self.check_conversion(DesignVecProblem(self.nvars).createDesignVec())
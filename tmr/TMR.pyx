@@ -2828,6 +2828,45 @@ cdef class QuadrantArray:
         index = t - array
         return index
 
+    def getLevels(self):
+        """
+        getLevels(self)
+
+        Get the refinement levels of all the quadrants in the array
+
+        Returns:
+            np.ndarray: An array of the quadrant levels
+        """
+        cdef int size = 0
+        cdef int i = 0
+        cdef TMRQuadrant *array
+        self.ptr.getArray(&array, &size)
+        cdef np.ndarray[int, ndim=1, mode='c'] levels = np.zeros(size, dtype=np.intc)
+        for i in range(size):
+            levels[i] = array[i].level
+        return levels
+
+    def getTagsAndInfo(self):
+        """
+        getTagsAndInfo(self)
+
+        Get the tag and info members of all the quadrants in the array
+
+        Returns:
+            np.ndarray: An array of the quadrant tags
+            np.ndarray: An array of the quadrant info values
+        """
+        cdef int size = 0
+        cdef int i = 0
+        cdef TMRQuadrant *array
+        self.ptr.getArray(&array, &size)
+        cdef np.ndarray[int, ndim=1, mode='c'] tags = np.zeros(size, dtype=np.intc)
+        cdef np.ndarray[int, ndim=1, mode='c'] info = np.zeros(size, dtype=np.intc)
+        for i in range(size):
+            tags[i] = array[i].tag
+            info[i] = array[i].info
+        return tags, info
+
 cdef _init_QuadrantArray(TMRQuadrantArray *array, int self_owned):
     arr = QuadrantArray()
     arr.ptr = array
@@ -3331,6 +3370,45 @@ cdef class OctantArray:
         index = t - array
         return index
 
+    def getLevels(self):
+        """
+        getLevels(self)
+
+        Get the refinement levels of all the octants in the array
+
+        Returns:
+            np.ndarray: An array of the octant levels
+        """
+        cdef int size = 0
+        cdef int i = 0
+        cdef TMROctant *array
+        self.ptr.getArray(&array, &size)
+        cdef np.ndarray[int, ndim=1, mode='c'] levels = np.zeros(size, dtype=np.intc)
+        for i in range(size):
+            levels[i] = array[i].level
+        return levels
+
+    def getTagsAndInfo(self):
+        """
+        getTagsAndInfo(self)
+
+        Get the tag and info members of all the octants in the array
+
+        Returns:
+            np.ndarray: An array of the octant tags
+            np.ndarray: An array of the octant info values
+        """
+        cdef int size = 0
+        cdef int i = 0
+        cdef TMROctant *array
+        self.ptr.getArray(&array, &size)
+        cdef np.ndarray[int, ndim=1, mode='c'] tags = np.zeros(size, dtype=np.intc)
+        cdef np.ndarray[int, ndim=1, mode='c'] info = np.zeros(size, dtype=np.intc)
+        for i in range(size):
+            tags[i] = array[i].tag
+            info[i] = array[i].info
+        return tags, info
+
 cdef _init_OctantArray(TMROctantArray *array, int self_owned):
     arr = OctantArray()
     arr.ptr = array
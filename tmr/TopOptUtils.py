@@ -6,9 +6,10 @@ import numpy as np
 from six import iteritems
 
 try:
-    from scipy.optimize import minimize
+    from scipy.optimize import minimize, nnls
 except:
     minimize = None
+    nnls = None
 
 
 def createTopoProblem(
@@ -154,18 +155,19 @@ def computeVertexLoad(name, forest, assembler, point_force):
     force_array = force.getArray()
 
     # Retrieve the node numbers from the forest
-    nodes = forest.getNodesWithName(name)
+    nodes = np.asarray(forest.getNodesWithName(name), dtype=int)
 
     comm = assembler.getMPIComm()
     node_range = forest.getNodeRange()
 
-    # Add the point force into the force arrays
-    for node in nodes:
-        if (node >= node_range[comm.rank]) and (node < node_range[comm.rank + 1]):
-            index = node - node_range[comm.rank]
-            force_array[
-                vars_per_node * index : vars_per_node * (index + 1)
-            ] += point_force[:]
+    # Find the local indices of the nodes owned by this processor
+    lower = node_range[comm.rank]
+    upper = node_range[comm.rank + 1]
+    index = nodes[(nodes >= lower) & (nodes < upper)] - lower
+
+    # Add the point force into the force arrays, np.add.at accumulates the
+    # force for repeated nodes in the same way as adding them one at a time
+    np.add.at(force_array.reshape((-1, vars_per_node)), index, np.asarray(point_force))
 
     # Match the ordering of the vector
     assembler.reorderVec(force)
@@ -173,6 +175,28 @@ def computeVertexLoad(name, forest, assembler, point_force):
     return force
 
 
+def _getTagsAndInfo(octants):
+    """
+    Get the tags and info values of all the octants or quadrants in an array
+
+    Args:
+        octants (OctantArray or QuadrantArray): The octants or quadrants
+
+    Returns:
+        np.ndarray: The tag of each octant or quadrant
+        np.ndarray: The info value of each octant or quadrant
+    """
+
+    # Fall back to reading the values one at a time if the TMR build does not
+    # provide the bulk accessor, skipping the entries without an index
+    if hasattr(octants, "getTagsAndInfo"):
+        return octants.getTagsAndInfo()
+    octants = [oc for oc in octants if oc.tag is not None]
+    tags = np.fromiter((oc.tag for oc in octants), dtype=np.intc, count=len(octants))
+    info = np.fromiter((oc.info for oc in octants), dtype=np.intc, count=len(octants))
+    return tags, info
+
+
 def computeTractionLoad(names, forest, assembler, trac):
     """
     Add a surface traction to all quadrants or octants that touch a face or edge with
@@ -193,22 +217,24 @@ def computeTractionLoad(names, forest, assembler, trac):
         Vec: A force vector containing the traction
     """
 
+    if isinstance(names, str):
+        names = [names]
+
+    # Get the element tags and the local face or edge index of the octants or
+    # quadrants touching the named faces or edges
     if isinstance(forest, TMR.OctForest):
-        octants = forest.getOctants()
-        if isinstance(names, str):
-            face_octs = forest.getOctsWithName(names)
-        else:
-            face_octs = []
-            for name in names:
-                face_octs.extend(forest.getOctsWithName(name))
+        face_octs = [forest.getOctsWithName(name) for name in names]
     elif isinstance(forest, TMR.QuadForest):
-        octants = forest.getQuadrants()
-        if isinstance(names, str):
-            face_octs = forest.getQuadsWithName(names)
-        else:
-            face_octs = []
-            for name in names:
-                face_octs.extend(forest.getQuadsWithName(name))
+        face_octs = [forest.getQuadsWithName(name) for name in names]
+
+    tags = [np.zeros(0, dtype=np.intc)]
+    info = [np.zeros(0, dtype=np.intc)]
+    for octs in face_octs:
+        t, i = _getTagsAndInfo(octs)
+        tags.append(t)
+        info.append(i)
+    tags = np.concatenate(tags).tolist()
+    info = np.concatenate(info).tolist()
 
     # Create the force vector and zero the variables in the assembler
     force = assembler.createVec()
@@ -219,10 +245,8 @@ def computeTractionLoad(names, forest, assembler, trac):
     # Create the auxiliary element class
     aux = TACS.AuxElements()
 
-    for i in range(len(face_octs)):
-        index = face_octs[i].tag
-        if index is not None:
-            aux.addElement(index, trac[face_octs[i].info])
+    for index, face in zip(tags, info):
+        aux.addElement(index, trac[face])
 
     # Keep auxiliary elements already set in the assembler
     # aux_tmp = assembler.getAuxElements()
@@ -394,6 +418,64 @@ def addNaturalFrequencyConstraint(problem, omega_min, **kwargs):
     return
 
 
+def _getElementDesignVars(assembler):
+    """
+    Gather the design variables of all the local elements into a single array.
+    All the elements in the Assembler object must have the same number of
+    design variables.
+
+    Args:
+        assembler (Assembler): The TACS.Assembler object
+
+    Returns:
+        np.ndarray: (num_elems, num_dvs) array of the element design variables
+        int: The number of design variables per node
+    """
+
+    num_elems = assembler.getNumElements()
+    if num_elems == 0:
+        return np.zeros((0, 0)), 1
+
+    # Get the elements from the Assembler object
+    elems = assembler.getElements()
+
+    # Size the array from the first element and fill in the rows
+    dvs_per_node = elems[0].getDesignVarsPerNode()
+    dvs = np.empty((num_elems, len(elems[0].getDesignVars(0))))
+    for i, elem in enumerate(elems):
+        dvs[i] = elem.getDesignVars(i)
+
+    return dvs, dvs_per_node
+
+
+def getElementDesignValues(assembler, index=0, reverse=False):
+    """
+    Extract a single design value for each element in the Assembler object.
+
+    The value for each element is the maximum of the element design variables for
+    the given component index. If *reverse* is set, the minimum is used instead.
+
+    Args:
+        assembler (Assembler): The TACS.Assembler object
+        index (int): The component index of the design vector
+        reverse (bool): Use the minimum design value within each element
+
+    Returns:
+        np.ndarray: Array of the design values for each local element
+    """
+
+    # Reduce the design variables of the given component for all elements
+    dvs, dvs_per_node = _getElementDesignVars(assembler)
+    if dvs.shape[0] == 0:
+        return np.zeros(0)
+    elif reverse:
+        values = dvs[:, index::dvs_per_node].min(axis=1)
+    else:
+        values = dvs[:, index::dvs_per_node].max(axis=1)
+
+    return values
+
+
 def densityBasedRefine(
     forest,
     assembler,
@@ -425,34 +507,19 @@ def densityBasedRefine(
         max_lev (int): Maximum refinement level
     """
 
-    # Create refinement array
-    num_elems = assembler.getNumElements()
-    refine = np.zeros(num_elems, dtype=np.int32)
+    # Extract the design value used for refinement within each element
+    values = getElementDesignValues(assembler, index=index, reverse=reverse)
 
-    # Get the elements from the Assembler object
-    elems = assembler.getElements()
+    # Apply the refinement criteria to all elements at once, the upper limit
+    # takes precedence over the lower limit. The flags only take the values
+    # -1, 0 or 1 so they are stored as np.int8
+    sign = -1 if reverse else 1
+    refine = np.zeros(len(values), dtype=np.int8)
+    refine[values <= lower] = -sign
+    refine[values >= upper] = sign
 
-    for i in range(num_elems):
-        # Extract the design variables from the element
-        dvs_per_node = elems[i].getDesignVarsPerNode()
-        dvs = elems[i].getDesignVars(i)
-
-        # Apply the refinement criteria
-        if reverse:
-            value = np.min(dvs[index::dvs_per_node])
-            if value >= upper:
-                refine[i] = -1
-            elif value <= lower:
-                refine[i] = 1
-        else:
-            value = np.max(dvs[index::dvs_per_node])
-            if value >= upper:
-                refine[i] = 1
-            elif value <= lower:
-                refine[i] = -1
-
-    # Refine the forest
-    forest.refine(refine, min_lev=min_lev, max_lev=max_lev)
+    # Refine the forest (the forest expects a C int array)
+    forest.refine(refine.astype(np.int32), min_lev=min_lev, max_lev=max_lev)
 
     return
 
@@ -514,23 +581,36 @@ def approxDistanceRefine(
         filename=filename,
     )
 
-    # Create refinement array
+    # Create refinement array: refine all elements close to the boundary
+    # and coarsen all the others
     num_elems = assembler.getNumElements()
-    refine = np.zeros(num_elems, dtype=np.int32)
-
-    for i in range(num_elems):
-        # Apply the refinement criteria
-        if dist[i] <= refine_distance:
-            refine[i] = 1
-        else:
-            refine[i] = -1
+    refine = np.full(num_elems, -1, dtype=np.int8)
+    refine[dist[:num_elems] <= refine_distance] = 1
 
-    # Refine the forest
-    forest.refine(refine, min_lev=min_lev, max_lev=max_lev)
+    # Refine the forest (the forest expects a C int array)
+    forest.refine(refine.astype(np.int32), min_lev=min_lev, max_lev=max_lev)
 
     return
 
 
+def _getLevels(octants):
+    """
+    Get the levels of all the octants or quadrants in an array as an int array
+
+    Args:
+        octants (OctantArray or QuadrantArray): The octants or quadrants
+
+    Returns:
+        np.ndarray: The level of each octant or quadrant
+    """
+
+    # Fall back to reading the levels one at a time if the TMR build does not
+    # provide the bulk accessor
+    if hasattr(octants, "getLevels"):
+        return octants.getLevels()
+    return np.fromiter((oc.level for oc in octants), dtype=np.intc, count=len(octants))
+
+
 def targetRefine(
     forest,
     fltr,
@@ -592,51 +672,35 @@ def targetRefine(
         filename=filename,
     )
 
-    # Create refinement array
-    num_elems = assembler.getNumElements()
-    refine = np.zeros(num_elems, dtype=np.int32)
-
     # Compute the levels
     if isinstance(forest, TMR.OctForest):
-        octants = forest.getOctants()
-        lev = np.zeros(len(octants))
-        for i, oc in enumerate(octants):
-            lev[i] = oc.level
+        lev = _getLevels(forest.getOctants())
     elif isinstance(forest, TMR.QuadForest):
-        quads = forest.getQuadrants()
-        lev = np.zeros(len(quads))
-        for i, quad in enumerate(quads):
-            lev[i] = quad.level
+        lev = _getLevels(forest.getQuadrants())
 
-    # Get the elements from the Assembler object
-    elems = assembler.getElements()
+    # Extract the interior design values for all elements at once
+    values = getElementDesignValues(assembler, index=interior_index, reverse=reverse)
 
-    for i in range(num_elems):
-        # Apply the refinement criteria
-        if dist[i] <= refine_distance:
-            refine[i] = interface_lev - lev[i]
-        else:
-            # Now check whether this is in the interior or exterior of
-            # the domain
-            dvs_per_node = elems[i].getDesignVarsPerNode()
-            dvs = elems[i].getDesignVars(i)
-
-            # Apply the refinement criteria
-            if reverse:
-                value = np.min(dvs[interior_index::dvs_per_node])
-                if value >= 1.0 - cutoff:
-                    refine[i] = -1
-                elif value <= cutoff:
-                    refine[i] = interior_lev - lev[i]
-            else:
-                value = np.max(dvs[interior_index::dvs_per_node])
-                if value >= 1.0 - cutoff:
-                    refine[i] = interior_lev - lev[i]
-                elif value <= cutoff:
-                    refine[i] = -1
+    # Classify the elements away from the interface as interior or exterior
+    # elements, the high values take precedence if the two ranges overlap
+    high = values >= 1.0 - cutoff
+    low = ~high & (values <= cutoff)
+    if reverse:
+        interior, exterior = low, high
+    else:
+        interior, exterior = high, low
 
-    # Refine the forest
-    forest.refine(refine, min_lev=min_lev, max_lev=max_lev)
+    # Create refinement array: the interface criteria takes precedence
+    num_elems = assembler.getNumElements()
+    lev = lev[:num_elems]
+    interface = dist[:num_elems] <= refine_distance
+    refine = np.zeros(num_elems, dtype=np.int8)
+    refine[interior] = interior_lev - lev[interior]
+    refine[exterior] = -1
+    refine[interface] = interface_lev - lev[interface]
+
+    # Refine the forest (the forest expects a C int array)
+    forest.refine(refine.astype(np.int32), min_lev=min_lev, max_lev=max_lev)
 
     return
 
@@ -669,53 +733,53 @@ class OptFilterWeights:
                 )
             )
 
+        # Compute the normalized offsets of the off-diagonal points
+        self.offdiag = np.arange(self.n) != self.diag
+        D = (self.X[self.offdiag] - self.X[self.diag]) / self.delta
+
         self.dim = 3
         if len(self.X.shape) == 1 or self.X.shape[1] == 1:
             self.dim = 1
 
             # Compute the constraint matrix
-            A = np.zeros((2, self.n - 1))
+            dx = D.reshape(-1)
+            A = np.vstack((dx, 0.5 * dx**2))
 
             # Populate the b vector
             b = np.zeros(2)
             b[1] = H[0, 0]
 
-            index = 0
-            for i in range(self.n):
-                if i != self.diag:
-                    dx = (self.X[i] - self.X[self.diag]) / self.delta
-
-                    A[0, index] = dx
-                    A[1, index] = 0.5 * dx**2
-                    index += 1
-
         elif self.X.shape[1] == 2:
             self.dim = 2
 
             # Compute the constraint matrix
-            A = np.zeros((5, self.n - 1))
+            dx = D[:, 0]
+            dy = D[:, 1]
+            A = np.vstack((dx, dy, 0.5 * dx**2, 0.5 * dy**2, dx * dy))
 
             # Populate the b vector
             b = np.zeros(5)
             b[2] = H[0, 0]
             b[3] = H[1, 1]
             b[4] = 2.0 * H[0, 1]
-
-            index = 0
-            for i in range(self.n):
-                if i != self.diag:
-                    dx = (self.X[i, 0] - self.X[self.diag, 0]) / self.delta
-                    dy = (self.X[i, 1] - self.X[self.diag, 1]) / self.delta
-
-                    A[0, index] = dx
-                    A[1, index] = dy
-                    A[2, index] = 0.5 * dx**2
-                    A[3, index] = 0.5 * dy**2
-                    A[4, index] = dx * dy
-                    index += 1
         else:
             # Compute the constraint matrix
-            A = np.zeros((9, self.n - 1))
+            dx = D[:, 0]
+            dy = D[:, 1]
+            dz = D[:, 2]
+            A = np.vstack(
+                (
+                    dx,
+                    dy,
+                    dz,
+                    0.5 * dx**2,
+                    0.5 * dy**2,
+                    0.5 * dz**2,
+                    dy * dz,
+                    dx * dz,
+                    dx * dy,
+                )
+            )
 
             # Populate the b vector
             b = np.zeros(9)
@@ -726,26 +790,6 @@ class OptFilterWeights:
             b[7] = 2.0 * H[0, 2]
             b[8] = 2.0 * H[0, 1]
 
-            index = 0
-            for i in range(self.n):
-                if i != self.diag:
-                    dx = (self.X[i, 0] - self.X[self.diag, 0]) / self.delta
-                    dy = (self.X[i, 1] - self.X[self.diag, 1]) / self.delta
-                    dz = (self.X[i, 2] - self.X[self.diag, 2]) / self.delta
-
-                    A[0, index] = dx
-                    A[1, index] = dy
-                    A[2, index] = dz
-
-                    A[3, index] = 0.5 * dx**2
-                    A[4, index] = 0.5 * dy**2
-                    A[5, index] = 0.5 * dz**2
-
-                    A[6, index] = dy * dz
-                    A[7, index] = dx * dz
-                    A[8, index] = dx * dy
-                    index += 1
-
         self.b = b
         self.A = A
 
@@ -767,17 +811,70 @@ class OptFilterWeights:
         """Compute the derivative of the interpolation ocnstraints"""
         return self.A
 
+    def solve(self):
+        """
+        Find the non-negative weights with the minimum sum square that satisfy
+        the interpolation constraints.
+
+        The minimum norm solution of the equality constrained problem is
+        w = A^T (A A^T)^{-1} b. When it is non-negative the bounds are inactive
+        and it is the optimum. Otherwise, the problem is a least distance
+        program with the constraints A w >= b, -A w >= -b and w >= 0, which is
+        solved with a single NNLS problem (Lawson and Hanson, Ch. 23). SLSQP is
+        only used when the NNLS problem indicates the constraints are infeasible.
+
+        Returns:
+            np.ndarray: The optimized weights
+        """
+        try:
+            w = np.dot(self.A.T, np.linalg.solve(np.dot(self.A, self.A.T), self.b))
+            if np.all(w >= 0.0):
+                return w
+        except np.linalg.LinAlgError:
+            pass
+
+        # Set up the least distance program G w >= h and solve the NNLS problem
+        # min || E u - f || with E = [G^T; h^T] and f = [0, ..., 0, 1]
+        m = self.n - 1
+        G = np.vstack((self.A, -self.A, np.eye(m)))
+        h = np.concatenate((self.b, -self.b, np.zeros(m)))
+        E = np.vstack((G.T, h))
+        f = np.zeros(m + 1)
+        f[-1] = 1.0
+        u, rnorm = nnls(E, f, maxiter=50 * E.shape[1])
+
+        # The weights are recovered from the residual unless it vanishes
+        r = np.dot(E, u) - f
+        if rnorm > 0.0 and r[-1] != 0.0:
+            return np.maximum(-r[:m] / r[-1], 0.0)
+
+        # Set the bounds and initial point
+        w0 = np.ones(self.n - 1)
+        bounds = [(0, None)] * (self.n - 1)
+
+        res = minimize(
+            self.obj_func,
+            w0,
+            jac=self.obj_func_der,
+            method="SLSQP",
+            bounds=bounds,
+            constraints={
+                "type": "eq",
+                "fun": self.con_func,
+                "jac": self.con_func_der,
+            },
+        )
+
+        return res.x
+
     def set_alphas(self, w, alpha):
         """Compute the interpolating coefficients based on the weights"""
-        alpha[:] = 0.0
-        index = 0
-        for i in range(self.n):
-            if i != self.diag:
-                alpha[i] = w[index] / self.delta**2
-                alpha[self.diag] += w[index] / self.delta**2
-                index += 1
+        scaled = w / self.delta**2
 
-        alpha[self.diag] += 1.0
+        # The weights are stored in order at the off-diagonal entries, and
+        # the diagonal entry makes the coefficients sum to one
+        alpha[self.offdiag] = scaled
+        alpha[self.diag] = 1.0 + np.sum(scaled)
 
         return
 
@@ -801,45 +898,35 @@ class Mfilter(TMR.HelmholtzPUFilter):
         """
         self.r = r
         self.dim = dim
+
+        # Scratch direction used to build the boundary tangent plane
+        self.t = np.zeros(3)
+
+        # Filter second derivatives for the interior and boundary stencils
+        self.H3 = self.r**2 * np.eye(3)
+        self.H2 = self.r**2 * np.eye(2)
         return
 
     def getInteriorStencil(self, diag, X, alpha):
         """Get the weights for an interior stencil point"""
-        H = self.r**2 * np.eye(3)
+        H = self.H3
 
         # Reshape the values in the matrix
         X = X.reshape((-1, 3))
-        n = X.shape[0]
-
         if self.dim == 2:
             X = X[:, :2]
 
         # Set up the optimization problem
         opt = OptFilterWeights(diag, X, H)
 
-        # Set the bounds and initial point
-        w0 = np.ones(n - 1)
-        bounds = []
-        for i in range(n - 1):
-            bounds.append((0, None))
-
-        res = minimize(
-            opt.obj_func,
-            w0,
-            jac=opt.obj_func_der,
-            method="SLSQP",
-            bounds=bounds,
-            constraints={"type": "eq", "fun": opt.con_func, "jac": opt.con_func_der},
-        )
-
         # Set the optimized alpha values
-        opt.set_alphas(res.x, alpha)
+        opt.set_alphas(opt.solve(), alpha)
 
         return
 
     def getBoundaryStencil(self, diag, normal, X, alpha):
         """Get a sentcil point on the domain boundary"""
-        H = self.r**2 * np.eye(2)
+        H = self.H2
 
         # Reshape the values in the matrix
         X = X.reshape((-1, 3))
@@ -854,7 +941,8 @@ class Mfilter(TMR.HelmholtzPUFilter):
             # the domain boundary. First, compute an arbitrary direction
             # that is not aligned along the normal direction
             index = np.argmin(np.absolute(normal))
-            t = np.zeros(3)
+            t = self.t
+            t.fill(0.0)
             t[index] = 1.0
 
             # Compute the in-plane directions (orthogonal to the normal direction)
@@ -869,29 +957,21 @@ class Mfilter(TMR.HelmholtzPUFilter):
         # Set up the optimization problem
         opt = OptFilterWeights(diag, Xt, H)
 
-        # Set the bounds and initial point
-        w0 = np.ones(n - 1)
-        bounds = []
-        for i in range(n - 1):
-            bounds.append((0, None))
-
-        res = minimize(
-            opt.obj_func,
-            w0,
-            jac=opt.obj_func_der,
-            method="SLSQP",
-            bounds=bounds,
-            constraints={"type": "eq", "fun": opt.con_func, "jac": opt.con_func_der},
-        )
-
         # Set the optimized alpha values
-        opt.set_alphas(res.x, alpha)
+        opt.set_alphas(opt.solve(), alpha)
 
         return
 
 
 def setSurfaceBounds(
-    problem, comm, forest, names, face_lb=0.99, face_ub=1.0, constrain_octs=True
+    problem,
+    comm,
+    forest,
+    names,
+    face_lb=0.99,
+    face_ub=1.0,
+    constrain_octs=True,
+    work_vecs=None,
 ):
     """
     Set upper and lower bounds on specific faces to
@@ -909,6 +989,9 @@ def setSurfaceBounds(
             the octants/quadrants on the surface;
             If False, only constrain the boundary
             nodes.
+        work_vecs (tuple): optional design vectors (dv, lb, ub) created
+            by problem.createDesignVec() that are overwritten instead of
+            allocating new ones
 
     """
     assembler = problem.getAssembler()
@@ -917,40 +1000,53 @@ def setSurfaceBounds(
     assembler.getDesignVars(x_vec)
     x = x_vec.getArray()
 
-    dv = problem.createDesignVec()
-    lb = problem.createDesignVec()
-    ub = problem.createDesignVec()
-    dv[:] = x[:]
-    lb[:] = 1e-3
-    ub[:] = 1.0
+    if work_vecs is None:
+        dv = problem.createDesignVec()
+        lb = problem.createDesignVec()
+        ub = problem.createDesignVec()
+    else:
+        dv, lb, ub = work_vecs
+
+    # Set the default design variables and bounds through the arrays
+    dv_array = TMR.convertPVecToVec(dv).getArray()
+    lb_array = TMR.convertPVecToVec(lb).getArray()
+    ub_array = TMR.convertPVecToVec(ub).getArray()
+    np.copyto(dv_array, x)
+    lb_array.fill(1e-3)
+    ub_array.fill(1.0)
+
+    # Get the range of the locally owned nodes
+    mpi_rank = comm.Get_rank()
+    node_range = forest.getNodeRange()
+    lower = node_range[mpi_rank]
+    upper = node_range[mpi_rank + 1]
 
-    face_dv = 0.5 * (face_lb + face_ub)
-    for name in names:
-        mpi_rank = comm.Get_rank()
-        node_range = forest.getNodeRange()
+    if constrain_octs:
+        conn = forest.getMeshConn()
 
+    # Collect the nodes on all the named surfaces
+    node_octs = [np.zeros(0, dtype=np.intc)]
+    for name in names:
         if constrain_octs:
             if isinstance(forest, TMR.OctForest):
                 octs = forest.getOctsWithName(name)
             else:
                 octs = forest.getQuadsWithName(name)
-            conn = forest.getMeshConn()
-            node_octs = np.array([])
-            for oc in octs:
-                node_octs = np.append(node_octs, conn[oc.tag, :])
 
+            # Gather the nodes of all the octants at once
+            tags, _ = _getTagsAndInfo(octs)
+            node_octs.append(conn[tags, :].ravel())
         else:
-            node_octs = forest.getNodesWithName(name)
-        node_octs = node_octs.astype(int)
-
-        for i in range(len(node_octs)):
-            if (node_octs[i] >= node_range[mpi_rank]) and (
-                node_octs[i] < node_range[mpi_rank + 1]
-            ):
-                index = int(node_octs[i] - node_range[mpi_rank])
-                dv[index] = face_dv
-                lb[index] = face_lb
-                ub[index] = face_ub
+            node_octs.append(forest.getNodesWithName(name))
+    node_octs = np.concatenate(node_octs)
+
+    # Set the bounds for the locally owned nodes. Neighboring octants share
+    # nodes, so remove the repeated indices before the assignment
+    face_dv = 0.5 * (face_lb + face_ub)
+    index = np.unique(node_octs[(node_octs >= lower) & (node_octs < upper)] - lower)
+    dv_array[index] = face_dv
+    lb_array[index] = face_lb
+    ub_array[index] = face_ub
 
     problem.setInitDesignVars(dv, lbvec=lb, ubvec=ub)
     return
@@ -971,18 +1067,20 @@ def createNonDesignMassVec(assembler, names, comm, forest, m0=0.5):
     mvec = assembler.createDesignVec()
     mvals = mvec.getArray()
 
+    # Get the range of the locally owned nodes
+    mpi_rank = comm.Get_rank()
+    node_range = forest.getNodeRange()
+    lower = node_range[mpi_rank]
+    upper = node_range[mpi_rank + 1]
+
+    # Collect the nodes on all the named surfaces
+    node_octs = [np.zeros(0, dtype=np.intc)]
     for name in names:
-        mpi_rank = comm.Get_rank()
-        node_range = forest.getNodeRange()
-
-        node_octs = forest.getNodesWithName(name)
-        node_octs = node_octs.astype(int)
-
-        for i in range(len(node_octs)):
-            if (node_octs[i] >= node_range[mpi_rank]) and (
-                node_octs[i] < node_range[mpi_rank + 1]
-            ):
-                index = int(node_octs[i] - node_range[mpi_rank])
-                mvals[index] = m0
+        node_octs.append(forest.getNodesWithName(name))
+    node_octs = np.concatenate(node_octs)
+
+    # Set the non-design mass for the locally owned nodes
+    index = node_octs[(node_octs >= lower) & (node_octs < upper)] - lower
+    mvals[index] = m0
 
     return mvec